@@ -28,9 +28,25 @@ class Config:
     FOLDER_DIMENSIONS = "dimensions"
     FOLDER_CURRENCY = "currency"
     FOLDER_IMPORTS_EXPORTS = "imports_exports"
+    FOLDER_PARQUET_CACHE = "parquet_cache"
+    # Sorted reference_key of the rows loaded, one .npy per trade_type and period (dedup of incoming rows)
+    FOLDER_KEY_INDEX = "key_index"
 
     CURRENCY_FORECAST_HORIZON = 730 # days
 
+    # Rows per chunk when reading trade files in chunked (bounded-memory) mode
+    TRADE_CHUNK_SIZE = 500000
+    # Worker processes when parsing trade files in parallel
+    TRADE_WORKERS = 4
+    # Size cap of the Parquet cache of parsed trade files (least recently used files are evicted)
+    PARQUET_CACHE_MAX_MB = 2048
+    # Text columns of trade DFs with at most this ratio of distinct values to rows are kept as categorical when compacted
+    COMPACT_CATEGORY_RATIO = 0.5
+    # Compiled headers and column types of the DIN/DUS workbooks (rebuilt when a workbook changes)
+    HEADERS_CACHE_FILE = "headers_cache.json"
+    # CRC32, size and periods of the trade zip members already loaded (only new or changed members are parsed)
+    TRADE_MANIFEST_FILE = "trade_manifest.json"
+
     # Azure Storage
     AZURE_STORAGE_CONNECT_STR = os.getenv('AZURE_STORAGE_CONNECT_STR')
     database = {'database':
@@ -53,6 +69,30 @@ class Config:
     SQLALCHEMY_MAX_OVERFLOW = 0
     SQLALCHEMY_POOL_PRE_PING = True
 
+    # Bulk sink for DataFrames: 'csv' (.csv file + BULK INSERT, the file must be readable by the SQL Server service) or
+    # 'executemany' (batches of parameterized INSERT over the client connection, works with a remote DB)
+    BULK_SINK = 'csv'
+    BULK_BATCH_SIZE = 50000
+    # Connections used to load partitions (period_id) in parallel
+    DB_LOAD_WORKERS = 4
+    # Secondary indexes of imports and exports are disabled during a load (and rebuilt after) when the incoming rows
+    # are at least this fraction of the rows in the table. Rows per batch of BULK INSERT in that case.
+    INDEX_REBUILD_RATIO = 0.2
+    BULK_INSERT_BATCH_SIZE = 500000
+    # Rows per batch of BULK INSERT into clustered columnstore tables (one compressed rowgroup, skips the deltastore)
+    COLUMNSTORE_BATCH_SIZE = 1048576
+    # Partitioning of imports and exports by period_key (YYYYMM): one partition per month between these years
+    PARTITION_FUNCTION = "pf_period_key"
+    PARTITION_SCHEME = "ps_period_key"
+    PARTITION_FIRST_YEAR = 2015
+    PARTITION_LAST_YEAR = 2035
+    # Table (in the schema of imports and exports) with the periods loaded, see utils/load_ledger.py
+    LOAD_LEDGER_TABLE = "load_ledger"
+    # Slowest statements logged after running a SQL script (execute_sql_batch)
+    SQL_REPORT_TOP = 5
+    # Connections used to run independent statements of a SQL script in parallel (execute_sql_parallel)
+    DDL_WORKERS = 4
+
     # Unknown member default. Replaced with camera_param_dict value.
     UNKNOWN_MEMBER = 'Unknown'
 
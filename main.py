@@ -4,8 +4,18 @@ import os.path
 import time
 from utils.data_process import get_years_month_loaded, get_files_to_load, get_dimensions, col_to_str, \
     recreate_db, copy_csv_into_db, generate_temp_csv, drop_db_objects, get_currency, get_folders, load_only_last_year, \
-    check_for_incomplete_periods
-from utils.csv_load import load_trade_files
+    check_for_incomplete_periods, reset_trade_chunks, spill_trade_chunk, generate_temp_csv_from_chunks, load_side_table, \
+    copy_partitioned_into_db, get_storage_commands, get_column_types, compact_frame, delete_moved_rows, \
+    get_period_id_from_key
+from utils.csv_load import load_trade_files, load_trade_files_chunked, load_trade_files_parallel, load_trade_projection, \
+    load_changed_trade_files, get_years_month_to_load, bootstrap_manifest
+from utils.trade_manifest import load_manifest, save_manifest, get_loaded_manifest
+from utils.load_ledger import get_years_month_loaded_from_ledger, set_periods_in_progress, set_periods_loaded, \
+    set_periods_recounted, get_fingerprints
+from utils.trade_schema import get_trade_schema, get_column_sql_type
+from utils.parquet_cache import clear_cache
+from utils.key_index import clear_key_index, drop_duplicated_rows, get_moved_keys, remove_period_keys, \
+    update_key_index
 from utils.sql_server_connector import SqlServerConnector, sqlalchemy_db_uri
 from utils.azure_blob_storage import AzureBlogStorage
 from utils.plot_functions import aggregate_canola_imports, generate_missing_dates, create_imports_canola_plot
@@ -25,6 +35,7 @@ import urllib.request
 import json
 import plotly.io as pio
 from datetime import datetime
+import argparse
 pio.renderers.default = "browser"
 
 TL = TolveetLogger()
@@ -85,7 +96,8 @@ logger = TL.get_tolveet_logger()
 # 'is_init = False'
 
 # All dimensions, column names and exchange are reloaded on every run. Truncate in place to replace data.
-# In a recurrent run, only the last year is actually processed.
+# In a recurrent run, only new or changed trade files are processed (only the last year with 'is_manifest = False' and
+# in the first run, which starts the manifest).
 
 
 
@@ -100,366 +112,535 @@ azure_storage_url = "https://tolveetstorage.blob.core.windows.net/other/canolach
 is_init = False
 is_sample = False
 is_execute_queries = True
+# Reporting queries: statements per transaction and whether to stop at the first error (the rest is not run).
+sql_report_transaction_size = 1
+is_sql_stop_on_error = False
+# Run independent reporting queries in parallel on Config.DDL_WORKERS connections (one transaction per statement).
+is_sql_parallel = True
 is_remove_tmp = True
-start_total = time.time()
-
-### ///// DB CONNECTORS
-logger.info("///////////////////////////////////////////////////////")
-logger.info("////// FILE EXTRACTION AND DATAFRAME APPENDING ///////")
-logger.info("//////////////////////////////////////////////////////")
-
-start_db_connectors = time.time()
-
-storage = AzureBlogStorage(conn_str=Config.AZURE_STORAGE_CONNECT_STR, log_prefix='')
-
-conn_str = sqlalchemy_db_uri(Config.database)
-conn = SqlServerConnector(conn_str=conn_str,
-                          storage=storage,
-                          log_prefix='')
-
-raw_connection = conn.engine.raw_connection()
-
-# Get year and months that have been loaded
-years_month_loaded = get_years_month_loaded(conn, schema_name)
-# Get all file names that will be used
-files_to_load = get_files_to_load(is_sample)
-# Read SQL queries
-utils_folder = os.path.join(MAIN_DIR, "utils")
-sql_init_file = "create_db_objects.sql"
-sql_report_files = "report_queries.sql"
-sql_init_commands = conn.parse_sql(os.path.join(utils_folder, sql_init_file))
-sql_report_commands = conn.parse_sql(os.path.join(utils_folder, sql_report_files), is_debug=False)
-# Get only section that drop stuff (to run first and facilitate debugging).
-sql_drop_commands = [x for x in sql_init_commands if x.lower().startswith('drop')]
-end_db_connectors = time.time() - start_db_connectors
-
-### FILES TO LOAD
-
-start_csv_load = time.time()
-
-# Load dimensions into a DF
-dimensions_dict = get_dimensions(files_to_load['dimension_files'])
-# Change all columns to string (to prevent data type issues).
-col_to_str(dimensions_dict)
-
-# Get currency exchange rates
-currency_converter = get_currency(currency_files=files_to_load['currency_files'])
-
-# Only consider files from the last year
-files_to_load = load_only_last_year(files_to_load)
-
-# Load trade data from .txt
-years_month_to_load, imports, exports = load_trade_files(files_to_load, is_init)
-
-end_csv_load = time.time() - start_csv_load
-
-if is_init:
-    logger.info("///////////////////////////////////")
-    logger.info("/// RECREATE EMPTY DATABASE (only use SAMPLE files)///////")
-    logger.info("///////////////////////////////////")
-
-    if is_sample:
-        start_init_db = time.time()
-        tables_to_drop = [imports.name, exports.name, currency_converter.name] + list(dimensions_dict.keys())
-        logger.info("Dropping DB objects...")
-        drop_db_objects(conn, raw_connection, tables_to_drop, schema_name, sql_drop_commands)
-        logger.info("Recreating empty DB...")
-        recreate_db(conn,
-                    raw_connection,
-                    imports,
-                    exports,
-                    dimensions_dict,
-                    currency_converter,
-                    schema_name,
-                    sql_init_commands,
-                    if_exists='append'
-                    )
-        logger.info("/////////// DB CREATION WITH EMPTY SCHEMA IS COMPLETE.")
-        end_init_db = time.time() - start_init_db
-        is_init = False
+# Bounded-memory ingest: read trade files in chunks of Config.TRADE_CHUNK_SIZE rows (not used to initialize).
+is_chunked = False
+# Parse trade files with Config.TRADE_WORKERS processes (the pipeline runs in main(), see the end of this script).
+is_parallel = False
+# Parse only the trade files that are new or changed since the last run (any year), see Config.TRADE_MANIFEST_FILE.
+# Otherwise only the last year is parsed.
+is_manifest = True
+# Keep parsed trade files in a Parquet cache (unchanged zip members are not parsed again).
+is_parquet_cache = True
+# Load imports and exports into the DB by period_id on Config.DB_LOAD_WORKERS connections (staging tables).
+is_partitioned_load = False
+# Upsert imports and exports: periods are bulk loaded into staging tables and merged on reference_key (one transaction
+# per period). Incomplete or changed periods are not deleted first and an interrupted run can be retried.
+is_upsert_load = False
+# Plan incremental loads from the load ledger (Config.LOAD_LEDGER_TABLE) instead of counting the rows of imports and
+# exports. The ledger is filled from imports and exports the first time.
+is_load_ledger = True
+# Keep one row per reference_key of the incoming imports and exports (overlapping releases of the trade files). Line
+# items already loaded in another period (key index, Config.FOLDER_KEY_INDEX, no DB round trip) are deleted from that
+# period after the load. Not used in chunked mode.
+is_key_dedup = True
+# Compact imports and exports after they are read (categorical and Arrow-backed text, smaller integer types), see
+# data_process.compact_frame.
+is_compact_frames = True
+# Partition imports and exports by period_key (YYYYMM) when the DB is created. Periods are then replaced with
+# TRUNCATE of their partition (and switched in with is_partitioned_load) instead of DELETE. Periods outside
+# Config.PARTITION_FIRST_YEAR to Config.PARTITION_LAST_YEAR are still deleted. Keep the same value after init.
+is_period_partitioned = False
+# Storage profile of imports and exports when the DB is created: 'rowstore' or 'columnstore' (clustered columnstore
+# index, for the reporting views that scan and aggregate by month, country and HS code).
+db_storage_profile = 'rowstore'
+# Reporting-only refresh: read only the columns each report needs into a lean side table (<schema_name>.<table>).
+# The imports and exports tables are not loaded.
+is_report_projection = False
+report_projections = {
+    'imports_canola_lean': {'trade_type': 'imports',
+                            'columns': ['PA_ORIG', 'ARANC_NAC', 'DNOMBRE', 'CANT_MERC', 'MEDIDA', 'PRE_UNIT',
+                                        'CIF_ITEM', 'MONEDA']}
+}
+
+
+def main():
+    # is_init is set to False once the DB is recreated (the incremental load follows)
+    global is_init
+    start_total = time.time()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild-cache', action='store_true', help='Remove the Parquet cache of parsed trade files')
+    args, _ = parser.parse_known_args()
+
+    ### ///// DB CONNECTORS
+    logger.info("///////////////////////////////////////////////////////")
+    logger.info("////// FILE EXTRACTION AND DATAFRAME APPENDING ///////")
+    logger.info("//////////////////////////////////////////////////////")
+
+    start_db_connectors = time.time()
+
+    storage = AzureBlogStorage(conn_str=Config.AZURE_STORAGE_CONNECT_STR, log_prefix='')
+
+    conn_str = sqlalchemy_db_uri(Config.database)
+    conn = SqlServerConnector(conn_str=conn_str,
+                              storage=storage,
+                              log_prefix='')
+
+    # SQL scripts check out a connection from the pool of conn for each batch (see SqlServerConnector.get_connection)
+    raw_connection = None
+
+    # Get year and months that have been loaded
+    if is_load_ledger:
+        years_month_loaded = get_years_month_loaded_from_ledger(conn, schema_name)
     else:
-        logger.error("Use sample data to initialize.")
-
-
-if not is_init:
-    logger.info("///////////////////////////////////////////////")
-    logger.info("//// INCREMENTAL DATA LOADS (per month) ///////")
-    logger.info("//////////////////////////////////////////////")
-
-    start_data_process = time.time()
-
-    incremental_loads = years_month_loaded.merge(years_month_to_load, how='outer', on=["trade_type", "period_id"])
-    # Select years and months that should be loaded.
-    periods_to_load = incremental_loads[(incremental_loads['num_records_x'].isnull())]
-
-    periods_to_load_dict = {}
-    for t in trade_type:
-        df = periods_to_load[periods_to_load["trade_type"] == t]
-        periods = []
-        for index, row in df.iterrows():
-            periods.append(row['period_id'])
-        periods_to_load_dict[t] = periods
-    logger.info("periods_to_load_dict:")
-    logger.info(periods_to_load_dict)
-
-    # Some periods may not be complete in the DB, we need to remove them first.
-    periods_to_delete_dict = check_for_incomplete_periods(incremental_loads, trade_type, schema_name, conn, raw_connection)
-
-    # LOAD: Filter imports and exports. Also Add deleted periods.
-    for t in trade_type:
-        periods_to_load_dict[t] = periods_to_load_dict[t] + periods_to_delete_dict[t]
-
-    # Filter export and import df (select only what needs to be loaded
-    if len(imports) > 0:
-        imports = imports[imports.period_id.isin(periods_to_load_dict['imports'])]
-    imports.name = "imports"
-
-    if len(exports) > 0:
-        exports = exports[exports.period_id.isin(periods_to_load_dict['exports'])]
-    exports.name = "exports"
-
-    end_data_process = time.time() - start_data_process
-
-    start_data_load = time.time()
-    logger.info("Loading DF into DB....")
-    generate_temp_csv(imports, exports, schema_name)
-
-    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
-
-    is_loaded_imports, is_loaded_exports = copy_csv_into_db(conn, raw_connection, imports, exports, schema_name, currency_converter, dimensions_dict, is_remove_tmp=is_remove_tmp)
-    end_data_load = time.time() - start_data_load
-
-if not is_init and is_execute_queries:
-    logger.info("/////////////////////////////////////////")
-    logger.info("//// SQL REPORTING VIEWS UPDATE /////////")
-    logger.info("////////////////////////////////////////")
-
-    start_sql_report_queries = time.time()
-
-    if is_loaded_imports or is_loaded_exports:
-        logger.info("Running SQL Reporting queries...")
-        conn.execute_sql_batch(logger=logger,
-                               log_prefix='',
-                               raw_connection=raw_connection,
-                               query_parsed=sql_report_commands,
-                               debug=True)
-
-    logger.info("/////////////////////////////////////////")
-    logger.info("//// REPORTS AND PLOTS GENERATION /////////")
-    logger.info("////////////////////////////////////////")
-
-    blob_upload_lst = []
-    excel_file_lst = []
-    csv_file_lst = []
-    # Export views as .xlsx
-    views_to_zip = [
-                    'vw_imports_canola_trigo',
-                    'vw_imports_canola_report',
-                    'vw_exports_canola_trigo'
-    ]
-    for t in views_to_zip:
-        # t = 'vw_imports_canola_trigo'
-        logger.info("Reading SQL view "+t+" for extraction...")
-        vw_df = conn.read_table(table_name=t, schema=schema_name)
-        logger.info("Saving "+t+" to Excel...")
-        excel_file = t + ".xlsx"
-        zip_file = t + ".zip"
-        excel_path = str(os.path.join(MAIN_DIR, excel_file))
-        zip_path = str(os.path.join(MAIN_DIR, zip_file))
-        vw_df.to_excel(excel_path)
-        logger.info("Compressing to ZIP...")
-        rc = subprocess.call([r'C:\Program Files\7-Zip\7z.exe',
-                              'a',
-                              '-p' + excel_password,
-                              '-y',
-                              zip_path,
-                              excel_path
-                              ]
-                             , shell=True)
-        blob_upload_lst.append(zip_file)
-        excel_file_lst.append(excel_file)
-        if t == 'vw_imports_canola_report':
-            vw_imports_canola_report = vw_df
-
-    logger.info("Further post-processing of vw_imports_canola_report...")
-    # Get non seed records
-    vw_imports_canola_report = vw_imports_canola_report[vw_imports_canola_report['is_siembra'] == 0]
-
-    # remove \n and \r from country
-    vw_imports_canola_report = vw_imports_canola_report.assign(
-        pais_nombre_origen=vw_imports_canola_report.pais_nombre_origen.str.rstrip())
-
-    # Currency of Interest for Price (and transform to Quintal)
-    vw_imports_canola_report.loc[:, 'precio_fob_usd'] = vw_imports_canola_report['PRE_UNIT_MOD'] * \
-                                                        vw_imports_canola_report['to_usd'] * 100
-    vw_imports_canola_report.loc[:, 'precio_fob_cad'] = vw_imports_canola_report['PRE_UNIT_MOD'] * \
-                                                        vw_imports_canola_report['to_cad'] * 100
-    vw_imports_canola_report.loc[:, 'precio_cif_usd'] = vw_imports_canola_report['PRE_UNIT_CIF'] * \
-                                                        vw_imports_canola_report['to_usd'] * 100
-    vw_imports_canola_report.loc[:, 'precio_cif_cad'] = vw_imports_canola_report['PRE_UNIT_CIF'] * \
-                                                        vw_imports_canola_report['to_usd'] * 100
-
-    vw_imports_canola_report.loc[:, 'CANT_MERC_MOD'] = (vw_imports_canola_report['CANT_MERC_MOD'] / 100).round(
-        0)
-
-    imports_canola_agg = vw_imports_canola_report.groupby(by=['fecha_month', 'pais_nombre_origen'],
-                                                          as_index=False,
-                                                          group_keys=False).agg(
-        cantidad_quintal=pd.NamedAgg(column='CANT_MERC_MOD', aggfunc='sum'),
-        precio_fob_usd_quintal=pd.NamedAgg(column='precio_fob_usd', aggfunc='mean'),
-        precio_fob_cad_quintal=pd.NamedAgg(column='precio_fob_cad', aggfunc='mean'),
-        precio_cif_usd_quintal=pd.NamedAgg(column='precio_cif_usd', aggfunc='mean'),
-        precio_cif_cad_quintal=pd.NamedAgg(column='precio_cif_cad', aggfunc='mean')
-    )
-
-
-
-    # Aggregate all countries and compute weighted average
-    imports_canola_agg_all = aggregate_canola_imports(input_df=imports_canola_agg, country_name='TODOS')
-    # Generate missing timestamps
-    date_from = imports_canola_agg_all["fecha_month"].min()
-    date_to = imports_canola_agg_all["fecha_month"].max()
-    # countries with imports
-    countries_with_imports = list(set(imports_canola_agg['pais_nombre_origen']))
-
-    # Generate DF by country
-    logger.info("Countries with imports:")
-    logger.info(countries_with_imports)
-
-    csv_dict = {}
-    csv_dict['imports_canola_agg_all'] = imports_canola_agg_all
-
-    imports_countries = []
-    imports_countries.append('all')
-
-    for c in countries_with_imports:
-        country_name = c.lower()
-        imports_canola_agg_country = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == c]
-        csv_dict['imports_canola_agg_' + country_name] = imports_canola_agg_country
-        imports_countries.append(country_name)
-
-    # imports_canola_agg_canada = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == 'CANADA']
-    # imports_canola_agg_argentina = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == 'ARGENTINA']
-
-    # imports_canola_agg_otros = imports_canola_agg[
-    #     ~imports_canola_agg['pais_nombre_origen'].isin(['ARGENTINA', 'CANADA'])]
-    # if len(imports_canola_agg_otros) > 0:
-    #     imports_canola_agg_otros = aggregate_canola_imports(input_df=imports_canola_agg_otros,
-    #                                                         country_name='OTROS')
-
-    # csv_dict = {'imports_canola_agg_all': imports_canola_agg_all,
-    #             'imports_canola_agg_canada': imports_canola_agg_canada,
-    #             'imports_canola_agg_argentina': imports_canola_agg_argentina,
-    #             'imports_canola_agg_otros': imports_canola_agg_otros}
-
-    logger.info("Adding missing dates (for reporting)...")
-    for k, v in csv_dict.items():
-        logger.info("Working on " + k +" ...")
-        if len(v) > 0:
-            v = generate_missing_dates(df=v, date_from=date_from, date_to=date_to)
-            csv_dict[k] = v
-        # Export report data as .csv
-        csv_file = k + ".csv"
-        csv_path = str(os.path.join(MAIN_DIR, csv_file))
-        v.to_csv(csv_path, index=False)
-        csv_file_lst.append(csv_file)
-
-    logger.info("Create plot from csv and save as JSON...")
-    graph_json_name_lst = []
-    for f, v in csv_dict.items():
-        graph_json_file_name = f + '_graph.json'
-        graph_json_name_lst.append(graph_json_file_name)
-        title = "Pais: " + f.split('_')[-1].capitalize()
-        df = pd.read_csv(f + '.csv')
-        if len(df) > 0:
-            fig = create_imports_canola_plot(df=df, title=title)
-            # fig.show()
-            graph_json = dumps(fig, cls=PlotlyJSONEncoder)
+        years_month_loaded = get_years_month_loaded(conn, schema_name)
+    # Get all file names that will be used
+    files_to_load = get_files_to_load(is_sample)
+    # Read SQL queries
+    utils_folder = os.path.join(MAIN_DIR, "utils")
+    sql_init_file = "create_db_objects.sql"
+    sql_report_files = "report_queries.sql"
+    sql_init_commands = conn.parse_sql(os.path.join(utils_folder, sql_init_file))
+    sql_report_commands = conn.parse_sql(os.path.join(utils_folder, sql_report_files), is_debug=False)
+    # Get only section that drop stuff (to run first and facilitate debugging).
+    sql_drop_commands = [x for x in sql_init_commands if x.lower().startswith('drop')]
+    end_db_connectors = time.time() - start_db_connectors
+
+    ### FILES TO LOAD
+
+    start_csv_load = time.time()
+
+    # Load dimensions into a DF
+    dimensions_dict = get_dimensions(files_to_load['dimension_files'])
+    # Change all columns to string (to prevent data type issues).
+    col_to_str(dimensions_dict)
+
+    # Get currency exchange rates
+    currency_converter = get_currency(currency_files=files_to_load['currency_files'])
+
+    if args.rebuild_cache:
+        clear_cache()
+
+    manifest, changed_periods_dict = None, None
+
+    # Trade files loaded in previous runs. Without a manifest (first run or new DB) the last year is loaded and the
+    # manifest is started from all the trade files.
+    previous_manifest = load_manifest() if is_manifest and not is_init else {}
+    is_manifest_bootstrap = is_manifest and len(previous_manifest) == 0 and not is_report_projection and not is_chunked \
+                            and not is_parallel
+    if is_manifest_bootstrap:
+        manifest = bootstrap_manifest(files_to_load)
+
+    # Only consider files from the last year
+    if not is_manifest or is_manifest_bootstrap or is_init or is_chunked or is_parallel:
+        files_to_load = load_only_last_year(files_to_load)
+
+    # Load trade data from .txt
+    if is_report_projection and not is_init:
+        is_loaded_imports, is_loaded_exports = False, False
+        for table_name, projection in report_projections.items():
+            df_projection = load_trade_projection(files_to_load, projection['trade_type'], projection['columns'])
+            load_side_table(conn, df_projection, table_name, schema_name)
+            del df_projection
+    elif is_chunked and not is_init:
+        # Chunks are saved to .csv per period as they are read. Only the number of records per period is kept.
+        reset_trade_chunks()
+        years_month_to_load = load_trade_files_chunked(files_to_load,
+                                                       on_chunk=lambda t, chunk: spill_trade_chunk(chunk, t, schema_name))
+        imports, exports = None, None
+    elif is_parallel:
+        years_month_to_load, imports, exports = load_trade_files_parallel(files_to_load, is_init)
+    elif is_manifest and not is_init and not is_manifest_bootstrap:
+        years_month_to_load, imports, exports, manifest, changed_periods_dict = load_changed_trade_files(
+            files_to_load, previous_manifest, is_cache=is_parquet_cache)
+    else:
+        years_month_to_load, imports, exports = load_trade_files(files_to_load, is_init, is_cache=is_parquet_cache)
+
+    if is_compact_frames and not is_report_projection:
+        imports = compact_frame(imports)
+        exports = compact_frame(exports)
+
+    end_csv_load = time.time() - start_csv_load
+
+    if is_init:
+        logger.info("///////////////////////////////////")
+        logger.info("/// RECREATE EMPTY DATABASE (only use SAMPLE files)///////")
+        logger.info("///////////////////////////////////")
+
+        if is_sample:
+            start_init_db = time.time()
+            tables_to_drop = [imports.name, exports.name, currency_converter.name, Config.LOAD_LEDGER_TABLE] + \
+                             list(dimensions_dict.keys())
+            logger.info("Dropping DB objects...")
+            drop_db_objects(conn, raw_connection, tables_to_drop, schema_name, sql_drop_commands)
+            logger.info("Recreating empty DB...")
+            recreate_db(conn,
+                        raw_connection,
+                        imports,
+                        exports,
+                        dimensions_dict,
+                        currency_converter,
+                        schema_name,
+                        sql_init_commands,
+                        if_exists='append',
+                        storage_commands=get_storage_commands(schema_name, is_partitioned=is_period_partitioned,
+                                                              is_columnstore=db_storage_profile == 'columnstore'),
+                        column_types=get_column_types(*get_trade_schema(files_to_load['headers_files'],
+                                                                        get_type=get_column_sql_type)),
+                        is_load_ledger=is_load_ledger
+                        )
+            logger.info("/////////// DB CREATION WITH EMPTY SCHEMA IS COMPLETE.")
+            clear_key_index()
+            if is_load_ledger:
+                # New (empty) ledger
+                years_month_loaded = get_years_month_loaded_from_ledger(conn, schema_name)
+            end_init_db = time.time() - start_init_db
+            is_init = False
         else:
-            fig = None
-            graph_json = 1
-        graph_json_file = open(graph_json_file_name, "wb")
-        pickle.dump(graph_json, graph_json_file)
-        graph_json_file.close()
-        blob_upload_lst.append(graph_json_file_name)
-
-    logger.info("Saving countries of interest...")
-    countries_json_file_name = 'imports_countries.json'
-    countries_json = dumps(imports_countries)
-    countries_json_file = open('imports_countries.json', "wb")
-    pickle.dump(countries_json, countries_json_file)
-    countries_json_file.close()
-    blob_upload_lst.append(countries_json_file_name)
-
-    logger.info("Uploading to Azure Blob Storage...")
-    for f in set(blob_upload_lst):
-        storage.file_upload(container=azure_storage_container,
-                            file_name=f,
-                            file_path=MAIN_DIR,
-                            des_folder=azure_storage_folder)
-
-    logger.info("Deleting files...")
-    for f in blob_upload_lst + excel_file_lst + csv_file_lst:
-        if os.path.exists(f):
-            os.remove(f)
+            logger.error("Use sample data to initialize.")
+
+
+    if not is_init and not is_report_projection and imports is not None:
+        if is_key_dedup and not is_chunked:
+            imports = drop_duplicated_rows(imports, 'imports')
+            exports = drop_duplicated_rows(exports, 'exports')
+        # Records and fingerprints of the rows to load. Always computed here (after compaction and dedup) so that they do
+        # not depend on the loading mode.
+        years_month_to_load = get_years_month_to_load([imports, exports])
+
+    if not is_init and not is_report_projection:
+        logger.info("///////////////////////////////////////////////")
+        logger.info("//// INCREMENTAL DATA LOADS (per month) ///////")
+        logger.info("//////////////////////////////////////////////")
+
+        start_data_process = time.time()
+
+        incremental_loads = years_month_loaded.merge(years_month_to_load, how='outer', on=["trade_type", "period_id"])
+        # Select years and months that should be loaded.
+        periods_to_load = incremental_loads[(incremental_loads['num_records_x'].isnull())]
+
+        periods_to_load_dict = {}
+        for t in trade_type:
+            df = periods_to_load[periods_to_load["trade_type"] == t]
+            periods = []
+            for index, row in df.iterrows():
+                periods.append(row['period_id'])
+            periods_to_load_dict[t] = periods
+        logger.info("periods_to_load_dict:")
+        logger.info(periods_to_load_dict)
+
+        # Some periods may not be complete in the DB, we need to remove them first.
+        periods_to_delete_dict = check_for_incomplete_periods(incremental_loads, trade_type, schema_name, conn, raw_connection,
+                                                              changed_periods_dict, is_period_partitioned,
+                                                              is_delete=not (is_upsert_load and not is_chunked),
+                                                              on_delete=(lambda t, periods: set_periods_in_progress(
+                                                                  conn, schema_name, t, periods)) if is_load_ledger else None)
+
+        # LOAD: Filter imports and exports. Also Add deleted periods.
+        for t in trade_type:
+            periods_to_load_dict[t] = periods_to_load_dict[t] + periods_to_delete_dict[t]
+
+        # Filter export and import df (select only what needs to be loaded
+        if not is_chunked:
+            if len(imports) > 0:
+                imports = imports[imports.period_id.isin(periods_to_load_dict['imports'])]
+            imports.name = "imports"
+
+            if len(exports) > 0:
+                exports = exports[exports.period_id.isin(periods_to_load_dict['exports'])]
+            exports.name = "exports"
+
+        end_data_process = time.time() - start_data_process
+
+        start_data_load = time.time()
+        if is_load_ledger:
+            for t in trade_type:
+                set_periods_in_progress(conn, schema_name, t, periods_to_load_dict[t])
+        logger.info("Loading DF into DB....")
+        if is_chunked:
+            generate_temp_csv_from_chunks(periods_to_load_dict, schema_name)
+        elif Config.BULK_SINK == 'csv' and not is_partitioned_load and not is_upsert_load:
+            generate_temp_csv(imports, exports, schema_name)
+
+        project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+
+        if (is_partitioned_load or is_upsert_load) and not is_chunked:
+            is_loaded_imports, is_loaded_exports = copy_partitioned_into_db(conn, imports, exports, schema_name, currency_converter, dimensions_dict, is_remove_tmp=is_remove_tmp, is_partitioned=is_period_partitioned, is_upsert=is_upsert_load)
         else:
-            logger.warning("Can not delete "+f+" as it doesn't exists")
-
-    for f in graph_json_name_lst:
-        logger.info("Plotting..." + str(f))
-        try:
-            ff = urllib.request.urlopen(azure_storage_url + f)
-            ff_obj = pickle.load(ff)
-            ff.close()
-            fig = pio.from_json(ff_obj)
-            fig.show()
-        except Exception as ex:
-            logger.warning("Plot "+f+" cannot be created.")
-
-    end_sql_report_queries = time.time() - start_sql_report_queries
-
-
-
-end_total = time.time() - start_total
-
-try:
-    end_db_connectors = str(round((end_db_connectors % 3600) / 60, 2))
-    print("DB CONNECTORS: {}".format(end_db_connectors))
-except NameError:
-    pass
-
-try:
-    end_csv_load = str(round((end_csv_load % 3600) / 60, 2))
-    print("CSV LOAD: {}".format(end_csv_load))
-except NameError:
-    pass
-
-try:
-    end_init_db = str(round((end_init_db % 3600) / 60, 2))
-    print("INIT DB: {}".format(end_init_db))
-except NameError:
-    pass
-
-try:
-    end_data_process = str(round((end_data_process % 3600) / 60, 2))
-    print("DATA PROCESS {}".format(end_data_process))
-except NameError:
-    pass
-
-try:
-    end_data_load = str(round((end_data_load % 3600) / 60, 2))
-    print("DATA LOAD TO DB {}".format(end_data_load))
-except NameError:
-    pass
-
-try:
-    end_sql_report_queries = str(round((end_sql_report_queries % 3600) / 60, 2))
-    print("SQL REPORTING QUERIES {}".format(end_sql_report_queries))
-except NameError:
-    pass
-
-try:
-    end_total = str(round((end_total % 3600) / 60,2))
-    print("TOTAL TIME:  {}".format(end_total))
-except NameError:
-    pass
\ No newline at end of file
+            is_loaded_imports, is_loaded_exports = copy_csv_into_db(conn, raw_connection, imports, exports, schema_name, currency_converter, dimensions_dict, is_remove_tmp=is_remove_tmp)
+        if is_load_ledger:
+            for t, is_loaded in [('imports', is_loaded_imports), ('exports', is_loaded_exports)]:
+                if is_loaded:
+                    set_periods_loaded(conn, schema_name, t, periods_to_load_dict[t], manifest=manifest,
+                                       fingerprints=get_fingerprints(years_month_to_load, t, periods_to_load_dict[t]))
+        if is_key_dedup and not is_chunked:
+            for df, is_loaded in [(imports, is_loaded_imports), (exports, is_loaded_exports)]:
+                if is_loaded:
+                    # Line items that moved to a loaded period: delete their copies in the previous periods
+                    moved_keys = get_moved_keys(df, df.name)
+                    if len(moved_keys) > 0:
+                        delete_moved_rows(conn, schema_name, df.name, moved_keys)
+                        remove_period_keys(df.name, moved_keys)
+                        if is_load_ledger:
+                            set_periods_recounted(conn, schema_name, df.name,
+                                                  [get_period_id_from_key(k) for k in moved_keys['period_key'].unique()])
+                    update_key_index(df, df.name, periods_to_load_dict[df.name])
+        if manifest is not None:
+            # Members are recorded only for the tables that were loaded (or had nothing to load)
+            loaded_trade_types = [t for t, is_loaded in [('imports', is_loaded_imports), ('exports', is_loaded_exports)]
+                                  if is_loaded or len(periods_to_load_dict[t]) == 0]
+            if not is_manifest_bootstrap:
+                save_manifest(get_loaded_manifest(manifest, previous_manifest, loaded_trade_types))
+            elif len(loaded_trade_types) == len(trade_type):
+                save_manifest(manifest)
+        end_data_load = time.time() - start_data_load
+
+    if not is_init and is_execute_queries:
+        logger.info("/////////////////////////////////////////")
+        logger.info("//// SQL REPORTING VIEWS UPDATE /////////")
+        logger.info("////////////////////////////////////////")
+
+        start_sql_report_queries = time.time()
+
+        if is_loaded_imports or is_loaded_exports:
+            logger.info("Running SQL Reporting queries...")
+            if is_sql_parallel:
+                sql_report = conn.execute_sql_parallel(logger=logger,
+                                                       log_prefix='',
+                                                       conn=conn,
+                                                       query_parsed=sql_report_commands,
+                                                       schema_name=schema_name,
+                                                       debug=True,
+                                                       is_stop_on_error=is_sql_stop_on_error)
+            else:
+                sql_report = conn.execute_sql_batch(logger=logger,
+                                                    log_prefix='',
+                                                    raw_connection=raw_connection,
+                                                    query_parsed=sql_report_commands,
+                                                    debug=True,
+                                                    transaction_size=sql_report_transaction_size,
+                                                    is_stop_on_error=is_sql_stop_on_error)
+
+        logger.info("/////////////////////////////////////////")
+        logger.info("//// REPORTS AND PLOTS GENERATION /////////")
+        logger.info("////////////////////////////////////////")
+
+        blob_upload_lst = []
+        excel_file_lst = []
+        csv_file_lst = []
+        # Export views as .xlsx
+        views_to_zip = [
+                        'vw_imports_canola_trigo',
+                        'vw_imports_canola_report',
+                        'vw_exports_canola_trigo'
+        ]
+        for t in views_to_zip:
+            # t = 'vw_imports_canola_trigo'
+            logger.info("Reading SQL view "+t+" for extraction...")
+            start_view = time.time()
+            vw_df = conn.read_table(table_name=t, schema=schema_name)
+            logger.info("View " + t + " read in " + str(round(time.time() - start_view, 2)) + " seconds.")
+            logger.info("Saving "+t+" to Excel...")
+            excel_file = t + ".xlsx"
+            zip_file = t + ".zip"
+            excel_path = str(os.path.join(MAIN_DIR, excel_file))
+            zip_path = str(os.path.join(MAIN_DIR, zip_file))
+            vw_df.to_excel(excel_path)
+            logger.info("Compressing to ZIP...")
+            rc = subprocess.call([r'C:\Program Files\7-Zip\7z.exe',
+                                  'a',
+                                  '-p' + excel_password,
+                                  '-y',
+                                  zip_path,
+                                  excel_path
+                                  ]
+                                 , shell=True)
+            blob_upload_lst.append(zip_file)
+            excel_file_lst.append(excel_file)
+            if t == 'vw_imports_canola_report':
+                vw_imports_canola_report = vw_df
+
+        logger.info("Further post-processing of vw_imports_canola_report...")
+        # Get non seed records
+        vw_imports_canola_report = vw_imports_canola_report[vw_imports_canola_report['is_siembra'] == 0]
+
+        # remove \n and \r from country
+        vw_imports_canola_report = vw_imports_canola_report.assign(
+            pais_nombre_origen=vw_imports_canola_report.pais_nombre_origen.str.rstrip())
+
+        # Currency of Interest for Price (and transform to Quintal)
+        vw_imports_canola_report.loc[:, 'precio_fob_usd'] = vw_imports_canola_report['PRE_UNIT_MOD'] * \
+                                                            vw_imports_canola_report['to_usd'] * 100
+        vw_imports_canola_report.loc[:, 'precio_fob_cad'] = vw_imports_canola_report['PRE_UNIT_MOD'] * \
+                                                            vw_imports_canola_report['to_cad'] * 100
+        vw_imports_canola_report.loc[:, 'precio_cif_usd'] = vw_imports_canola_report['PRE_UNIT_CIF'] * \
+                                                            vw_imports_canola_report['to_usd'] * 100
+        vw_imports_canola_report.loc[:, 'precio_cif_cad'] = vw_imports_canola_report['PRE_UNIT_CIF'] * \
+                                                            vw_imports_canola_report['to_usd'] * 100
+
+        vw_imports_canola_report.loc[:, 'CANT_MERC_MOD'] = (vw_imports_canola_report['CANT_MERC_MOD'] / 100).round(
+            0)
+
+        imports_canola_agg = vw_imports_canola_report.groupby(by=['fecha_month', 'pais_nombre_origen'],
+                                                              as_index=False,
+                                                              group_keys=False).agg(
+            cantidad_quintal=pd.NamedAgg(column='CANT_MERC_MOD', aggfunc='sum'),
+            precio_fob_usd_quintal=pd.NamedAgg(column='precio_fob_usd', aggfunc='mean'),
+            precio_fob_cad_quintal=pd.NamedAgg(column='precio_fob_cad', aggfunc='mean'),
+            precio_cif_usd_quintal=pd.NamedAgg(column='precio_cif_usd', aggfunc='mean'),
+            precio_cif_cad_quintal=pd.NamedAgg(column='precio_cif_cad', aggfunc='mean')
+        )
+
+
+
+        # Aggregate all countries and compute weighted average
+        imports_canola_agg_all = aggregate_canola_imports(input_df=imports_canola_agg, country_name='TODOS')
+        # Generate missing timestamps
+        date_from = imports_canola_agg_all["fecha_month"].min()
+        date_to = imports_canola_agg_all["fecha_month"].max()
+        # countries with imports
+        countries_with_imports = list(set(imports_canola_agg['pais_nombre_origen']))
+
+        # Generate DF by country
+        logger.info("Countries with imports:")
+        logger.info(countries_with_imports)
+
+        csv_dict = {}
+        csv_dict['imports_canola_agg_all'] = imports_canola_agg_all
+
+        imports_countries = []
+        imports_countries.append('all')
+
+        for c in countries_with_imports:
+            country_name = c.lower()
+            imports_canola_agg_country = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == c]
+            csv_dict['imports_canola_agg_' + country_name] = imports_canola_agg_country
+            imports_countries.append(country_name)
+
+        # imports_canola_agg_canada = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == 'CANADA']
+        # imports_canola_agg_argentina = imports_canola_agg[imports_canola_agg['pais_nombre_origen'] == 'ARGENTINA']
+
+        # imports_canola_agg_otros = imports_canola_agg[
+        #     ~imports_canola_agg['pais_nombre_origen'].isin(['ARGENTINA', 'CANADA'])]
+        # if len(imports_canola_agg_otros) > 0:
+        #     imports_canola_agg_otros = aggregate_canola_imports(input_df=imports_canola_agg_otros,
+        #                                                         country_name='OTROS')
+
+        # csv_dict = {'imports_canola_agg_all': imports_canola_agg_all,
+        #             'imports_canola_agg_canada': imports_canola_agg_canada,
+        #             'imports_canola_agg_argentina': imports_canola_agg_argentina,
+        #             'imports_canola_agg_otros': imports_canola_agg_otros}
+
+        logger.info("Adding missing dates (for reporting)...")
+        for k, v in csv_dict.items():
+            logger.info("Working on " + k +" ...")
+            if len(v) > 0:
+                v = generate_missing_dates(df=v, date_from=date_from, date_to=date_to)
+                csv_dict[k] = v
+            # Export report data as .csv
+            csv_file = k + ".csv"
+            csv_path = str(os.path.join(MAIN_DIR, csv_file))
+            v.to_csv(csv_path, index=False)
+            csv_file_lst.append(csv_file)
+
+        logger.info("Create plot from csv and save as JSON...")
+        graph_json_name_lst = []
+        for f, v in csv_dict.items():
+            graph_json_file_name = f + '_graph.json'
+            graph_json_name_lst.append(graph_json_file_name)
+            title = "Pais: " + f.split('_')[-1].capitalize()
+            df = pd.read_csv(f + '.csv')
+            if len(df) > 0:
+                fig = create_imports_canola_plot(df=df, title=title)
+                # fig.show()
+                graph_json = dumps(fig, cls=PlotlyJSONEncoder)
+            else:
+                fig = None
+                graph_json = 1
+            graph_json_file = open(graph_json_file_name, "wb")
+            pickle.dump(graph_json, graph_json_file)
+            graph_json_file.close()
+            blob_upload_lst.append(graph_json_file_name)
+
+        logger.info("Saving countries of interest...")
+        countries_json_file_name = 'imports_countries.json'
+        countries_json = dumps(imports_countries)
+        countries_json_file = open('imports_countries.json', "wb")
+        pickle.dump(countries_json, countries_json_file)
+        countries_json_file.close()
+        blob_upload_lst.append(countries_json_file_name)
+
+        logger.info("Uploading to Azure Blob Storage...")
+        for f in set(blob_upload_lst):
+            storage.file_upload(container=azure_storage_container,
+                                file_name=f,
+                                file_path=MAIN_DIR,
+                                des_folder=azure_storage_folder)
+
+        logger.info("Deleting files...")
+        for f in blob_upload_lst + excel_file_lst + csv_file_lst:
+            if os.path.exists(f):
+                os.remove(f)
+            else:
+                logger.warning("Can not delete "+f+" as it doesn't exists")
+
+        for f in graph_json_name_lst:
+            logger.info("Plotting..." + str(f))
+            try:
+                ff = urllib.request.urlopen(azure_storage_url + f)
+                ff_obj = pickle.load(ff)
+                ff.close()
+                fig = pio.from_json(ff_obj)
+                fig.show()
+            except Exception as ex:
+                logger.warning("Plot "+f+" cannot be created.")
+
+        end_sql_report_queries = time.time() - start_sql_report_queries
+
+
+    conn.log_pool_metrics()
+    end_total = time.time() - start_total
+
+    try:
+        end_db_connectors = str(round((end_db_connectors % 3600) / 60, 2))
+        print("DB CONNECTORS: {}".format(end_db_connectors))
+    except NameError:
+        pass
+
+    try:
+        end_csv_load = str(round((end_csv_load % 3600) / 60, 2))
+        print("CSV LOAD: {}".format(end_csv_load))
+    except NameError:
+        pass
+
+    try:
+        end_init_db = str(round((end_init_db % 3600) / 60, 2))
+        print("INIT DB: {}".format(end_init_db))
+    except NameError:
+        pass
+
+    try:
+        end_data_process = str(round((end_data_process % 3600) / 60, 2))
+        print("DATA PROCESS {}".format(end_data_process))
+    except NameError:
+        pass
+
+    try:
+        end_data_load = str(round((end_data_load % 3600) / 60, 2))
+        print("DATA LOAD TO DB {}".format(end_data_load))
+    except NameError:
+        pass
+
+    try:
+        end_sql_report_queries = str(round((end_sql_report_queries % 3600) / 60, 2))
+        print("SQL REPORTING QUERIES {}".format(end_sql_report_queries))
+    except NameError:
+        pass
+
+    try:
+        end_total = str(round((end_total % 3600) / 60,2))
+        print("TOTAL TIME:  {}".format(end_total))
+    except NameError:
+        pass
+
+
+# Worker processes of is_parallel import this module (with the "spawn" start method, Windows and macOS): the
+# pipeline only runs in the main process.
+if __name__ == '__main__':
+    main()
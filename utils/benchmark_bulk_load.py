@@ -0,0 +1,48 @@
+import os
+import time
+from config import Config, TolveetLogger
+from utils.data_process import get_files_to_load, get_folders
+from utils.csv_load import load_trade_files
+from utils.sql_server_connector import SqlServerConnector, sqlalchemy_db_uri
+
+# Compare the bulk sinks of SqlServerConnector.bulk_load: 'csv' (.csv file + BULK INSERT) against 'executemany'
+# (batches of parameterized INSERT over the client connection). The sample imports are loaded into a scratch table
+# <SCHEMA_NAME>.<TABLE_NAME> (dropped at the end). Run from the project folder (needs the DB in .env):
+# python -m utils.benchmark_bulk_load
+
+SCHEMA_NAME = "canola"
+TABLE_NAME = "benchmark_bulk_load"
+REPEAT = 10
+
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+
+def load_with_sink(conn, df, sink, temp_folder):
+    csv_file = os.path.join(temp_folder, SCHEMA_NAME + "." + TABLE_NAME + ".csv")
+    conn._truncate_table(table=TABLE_NAME, schema=SCHEMA_NAME)
+    start = time.perf_counter()
+    # The time of the csv sink includes writing the .csv file
+    conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=SCHEMA_NAME, table_name=TABLE_NAME, df=df,
+                   path_to_csv=temp_folder, sink=sink)
+    end = time.perf_counter() - start
+    if os.path.exists(csv_file):
+        os.remove(csv_file)
+    return end
+
+
+if __name__ == '__main__':
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    conn = SqlServerConnector(conn_str=sqlalchemy_db_uri(Config.database), log_prefix='')
+
+    years_month_to_load, imports, exports = load_trade_files(get_files_to_load(is_sample=True), is_init=False)
+    imports = imports.loc[imports.index.repeat(REPEAT)].reset_index(drop=True)
+    conn.create_table(df=imports.head(0), table_name=TABLE_NAME, schema=SCHEMA_NAME)
+
+    print("rows  sink         seconds  rows/sec")
+    for sink in ['csv', 'executemany']:
+        end = load_with_sink(conn, imports, sink, temp_folder)
+        print("{:d}  {:11s}  {:7.2f}  {:8.0f}".format(len(imports), sink, end, len(imports) / end))
+
+    conn._execute_command("DROP TABLE " + SCHEMA_NAME + "." + TABLE_NAME + ";")
+    conn.close()
@@ -0,0 +1,41 @@
+import time
+import numpy as np
+import pandas as pd
+from utils.data_process import concat_frames
+
+# Compare growing a DF with pd.concat inside a loop (previous approach) against collecting the parts and concatenating
+# once (concat_frames). Each part simulates a monthly trade file. Run from the project folder:
+# python -m utils.benchmark_concat
+
+ROWS_PER_FILE = 20000
+COLUMNS = 50
+
+
+def monthly_file(i):
+    return pd.DataFrame(np.random.rand(ROWS_PER_FILE, COLUMNS) + i)
+
+
+def loop_concat(num_files):
+    df = pd.DataFrame()
+    for i in range(num_files):
+        df = pd.concat([df, monthly_file(i)], ignore_index=True, sort=False)
+    return df
+
+
+def collect_and_concat(num_files):
+    parts = []
+    for i in range(num_files):
+        parts.append(monthly_file(i))
+    return concat_frames(parts)
+
+
+if __name__ == '__main__':
+    print("files  loop_concat[s]  concat_frames[s]")
+    for num_files in [6, 12, 24, 48, 96]:
+        start = time.perf_counter()
+        loop_concat(num_files)
+        end_loop = time.perf_counter() - start
+        start = time.perf_counter()
+        collect_and_concat(num_files)
+        end_once = time.perf_counter() - start
+        print("{:5d}  {:14.2f}  {:16.2f}".format(num_files, end_loop, end_once))
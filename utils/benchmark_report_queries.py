@@ -0,0 +1,36 @@
+import time
+from config import Config
+from utils.sql_server_connector import SqlServerConnector, sqlalchemy_db_uri
+
+# Latency of the reporting queries. Run it before and after changing the storage profile of imports and exports
+# (db_storage_profile in main.py) to compare. Run from the project folder (needs the DB in .env):
+# python -m utils.benchmark_report_queries
+
+SCHEMA_NAME = "canola"
+REPEAT = 5
+QUERIES = {
+    'vw_imports_canola_trigo': "SELECT * FROM {0}.vw_imports_canola_trigo;",
+    'vw_imports_canola_report': "SELECT * FROM {0}.vw_imports_canola_report;",
+    'vw_exports_canola_trigo': "SELECT * FROM {0}.vw_exports_canola_trigo;",
+    'imports_by_month_country': "SELECT period_id, PA_ORIG, COUNT(*) AS num_records FROM {0}.imports "
+                                "GROUP BY period_id, PA_ORIG;",
+    'imports_by_month_hs_code': "SELECT period_id, ARANC_NAC, COUNT(*) AS num_records FROM {0}.imports "
+                                "GROUP BY period_id, ARANC_NAC;",
+}
+
+
+if __name__ == '__main__':
+    conn = SqlServerConnector(conn_str=sqlalchemy_db_uri(Config.database), log_prefix='')
+    for table_name in ['imports', 'exports']:
+        print(table_name + " columnstore: " + str(conn.is_columnstore(table=table_name, schema=SCHEMA_NAME)))
+
+    print("query                        rows  min[s]  median[s]")
+    for name, query in QUERIES.items():
+        times = []
+        for i in range(REPEAT):
+            start = time.perf_counter()
+            df = conn.read_query(query.format(SCHEMA_NAME))
+            times.append(time.perf_counter() - start)
+        times.sort()
+        print("{:26s}  {:6d}  {:6.2f}  {:9.2f}".format(name, len(df), times[0], times[len(times) // 2]))
+    conn.close()
@@ -1,8 +1,6 @@
 
 
 
-
-
 -- -- -- -- -- -- -- -- -- -- -- --  
 -- -- -- I M P O R T S -- -- -- -- 
 -- -- -- -- -- -- -- -- -- -- -- -- 
@@ -10,6 +8,8 @@
 DROP INDEX IF EXISTS index_imports_reference_id ON canola.imports;
 DROP INDEX IF EXISTS index_imports_fecha ON canola.imports;
 DROP INDEX IF EXISTS index_imports_period_id ON canola.imports;
+DROP INDEX IF EXISTS index_imports_reference_key ON canola.imports;
+DROP INDEX IF EXISTS index_imports_period_key ON canola.imports;
 DROP INDEX IF EXISTS index_imports_ADU ON canola.imports;
 DROP INDEX IF EXISTS index_imports_CL_COMPRA ON canola.imports;
 DROP INDEX IF EXISTS index_imports_TIPO_DOCTO ON canola.imports;
@@ -26,35 +26,13 @@ DROP INDEX IF EXISTS index_imports_MEDIDA ON canola.imports;
 DROP TABLE IF EXISTS [canola].[imports_raw];
 
 
-
 DROP VIEW IF EXISTS [canola].[canola.vw_imports_canola_report];
 DROP VIEW IF EXISTS [canola].[canola.vw_imports_canola_trigo];
 
 
-DROP FUNCTION IF EXISTS [canola].[RemoveNonAlphaCharacters];
-
-UPDATE canola.imports SET fecha=CONVERT(CHAR(10),fecha,120);
-
-ALTER TABLE canola.imports ALTER COLUMN "fecha" date;
-ALTER TABLE canola.imports ALTER COLUMN reference_id VARCHAR(255) NOT NULL;
-ALTER TABLE canola.imports ALTER COLUMN period_id VARCHAR(10) NOT NULL;
-ALTER TABLE canola.imports ALTER COLUMN "ADU" integer;
-ALTER TABLE canola.imports ALTER COLUMN "CL_COMPRA" integer;
-ALTER TABLE canola.imports ALTER COLUMN "TIPO_DOCTO" integer;
-ALTER TABLE canola.imports ALTER COLUMN "MONEDA" integer;
-ALTER TABLE canola.imports ALTER COLUMN "PA_ORIG" integer;
-ALTER TABLE canola.imports ALTER COLUMN "PA_ADQ" integer;
-ALTER TABLE canola.imports ALTER COLUMN "CODPAISCON" integer;
-ALTER TABLE canola.imports ALTER COLUMN "CODPAISCIA" integer;
-ALTER TABLE canola.imports ALTER COLUMN "PTO_EMB" integer;
-ALTER TABLE canola.imports ALTER COLUMN "PTO_DESEM" integer;
-ALTER TABLE canola.imports ALTER COLUMN "VIA_TRAN" integer;
-ALTER TABLE canola.imports ALTER COLUMN "MEDIDA" integer;
-
-
-CREATE INDEX index_imports_reference_id ON canola.imports (reference_id);
+CREATE INDEX index_imports_reference_key ON canola.imports (reference_key);
 CREATE INDEX index_imports_fecha ON canola.imports (fecha);
-CREATE INDEX index_imports_period_id ON canola.imports (period_id);
+CREATE INDEX index_imports_period_key ON canola.imports (period_key);
 CREATE INDEX index_imports_ADU ON canola.imports ("ADU");
 CREATE INDEX index_imports_CL_COMPRA ON canola.imports ("CL_COMPRA");
 CREATE INDEX index_imports_TIPO_DOCTO ON canola.imports ("TIPO_DOCTO");
@@ -69,19 +47,6 @@ CREATE INDEX index_imports_VIA_TRAN ON canola.imports ("VIA_TRAN");
 CREATE INDEX index_imports_MEDIDA ON canola.imports ("MEDIDA");
 
 GO
-Create Function [canola].[RemoveNonAlphaCharacters](@Temp VarChar(1000))
-Returns VarChar(1000)
-AS
-Begin
-
-    Declare @KeepValues as varchar(50)
-    Set @KeepValues = '%[^0-9.]+%'
-    While PatIndex(@KeepValues, @Temp) > 0
-        Set @Temp = Stuff(@Temp, PatIndex(@KeepValues, @Temp), 1, '')
-
-    Return @Temp
-End;
-GO
 
 
 -- -- -- -- -- -- -- -- -- -- -- --  
@@ -91,6 +56,8 @@ GO
 DROP INDEX IF EXISTS index_exports_reference_id ON canola.exports;
 DROP INDEX IF EXISTS index_exports_fecha ON canola.exports;
 DROP INDEX IF EXISTS index_exports_period_id ON canola.exports;
+DROP INDEX IF EXISTS index_exports_reference_key ON canola.exports;
+DROP INDEX IF EXISTS index_exports_period_key ON canola.exports;
 DROP INDEX IF EXISTS index_exports_ADUANA ON canola.exports;
 DROP INDEX IF EXISTS index_exports_MONEDA ON canola.exports;
 DROP INDEX IF EXISTS index_exports_PAISCIATRANSP ON canola.exports;
@@ -102,26 +69,10 @@ DROP TABLE IF EXISTS [canola].[exports_raw];
 DROP VIEW IF EXISTS [canola].[canola.vw_exports_canola_report];
 DROP VIEW IF EXISTS [canola].[canola.vw_exports_canola_trigo];
 
-UPDATE canola.exports SET fecha=CONVERT(CHAR(10),fecha,120);
-
-ALTER TABLE canola.exports ALTER COLUMN "fecha" date;
-ALTER TABLE canola.exports ALTER COLUMN reference_id VARCHAR(255) NOT NULL;
-ALTER TABLE canola.exports ALTER COLUMN period_id VARCHAR(10) NOT NULL;
-ALTER TABLE canola.exports ALTER COLUMN "ADUANA" integer;
-ALTER TABLE canola.exports ALTER COLUMN "MONEDA" integer;
-ALTER TABLE canola.exports ALTER COLUMN "PAISCIATRANSP" numeric;
-ALTER TABLE canola.exports ALTER COLUMN "PAISCIATRANSP" integer;
-ALTER TABLE canola.exports ALTER COLUMN "VIATRANSPORTE" integer;
-ALTER TABLE canola.exports ALTER COLUMN "UNIDADMEDIDA" numeric;
-ALTER TABLE canola.exports ALTER COLUMN "UNIDADMEDIDA" integer;
-ALTER TABLE canola.exports ALTER COLUMN "FECHAACEPT" numeric;
-ALTER TABLE canola.exports ALTER COLUMN "FECHAACEPT" integer;
-
-
 
-CREATE INDEX index_exports_reference_id ON canola.exports (reference_id);
+CREATE INDEX index_exports_reference_key ON canola.exports (reference_key);
 CREATE INDEX index_exports_fecha ON canola.exports (fecha);
-CREATE INDEX index_exports_period_id ON canola.exports (period_id);
+CREATE INDEX index_exports_period_key ON canola.exports (period_key);
 CREATE INDEX index_exports_ADUANA ON canola.exports ("ADUANA");
 CREATE INDEX index_exports_MONEDA ON canola.exports ("MONEDA");
 CREATE INDEX index_exports_PAISCIATRANSP ON canola.exports ("PAISCIATRANSP");
@@ -129,24 +80,11 @@ CREATE INDEX index_exports_VIATRANSPORTE ON canola.exports ("VIATRANSPORTE");
 CREATE INDEX index_exports_UNIDADMEDIDA ON canola.exports ("UNIDADMEDIDA");
 
 
-
 -- -- -- -- -- -- -- -- -- -- -- --  
 -- -- -- C U R R E N C Y -- -- -- -- 
 -- -- -- -- -- -- -- -- -- -- -- -- 
 
--- remove new lines
-UPDATE canola.currency_converter SET to_clp=TRIM(REPLACE(REPLACE(to_clp, CHAR(13), ''), CHAR(10), ''));
-UPDATE canola.currency_converter SET to_usd=TRIM(REPLACE(REPLACE(to_usd, CHAR(13), ''), CHAR(10), ''));
-UPDATE canola.currency_converter SET to_eur=TRIM(REPLACE(REPLACE(to_eur, CHAR(13), ''), CHAR(10), ''));
-UPDATE canola.currency_converter SET to_cad=TRIM(REPLACE(REPLACE(to_cad, CHAR(13), ''), CHAR(10), ''));
-UPDATE canola.currency_converter SET to_aud=TRIM(REPLACE(REPLACE(to_aud, CHAR(13), ''), CHAR(10), ''));
-
-ALTER TABLE canola.currency_converter ALTER COLUMN "to_clp" float;
-ALTER TABLE canola.currency_converter ALTER COLUMN "to_usd" float;
-ALTER TABLE canola.currency_converter ALTER COLUMN "to_eur" float;
-ALTER TABLE canola.currency_converter ALTER COLUMN "to_cad" float;
-ALTER TABLE canola.currency_converter ALTER COLUMN "to_aud" float;
-
+-- Typed tables are created by recreate_db (data_process.get_column_types). Text is cleaned in pandas before the load.
 
 
 -- Remove all records that were not read properly.
@@ -1,11 +1,17 @@
+import numpy as np
 import pandas as pd
 import os
 import re
-from datetime import datetime
-from utils.data_process import get_folders
+from utils.data_process import get_folders, concat_frames, clean_text_columns
+from utils.trade_schema import get_trade_schema, get_parser_args, SCHEMA_VERSION
+from utils.parquet_cache import load_members_cached
+from utils.trade_manifest import scan_members, get_manifest_key, is_member_changed, get_members_with_periods, \
+    get_removed_members
 import time
-from io import StringIO
+import json
+import hashlib
 from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure Tolveet Logger
 from config import TolveetLogger, Config, MAIN_DIR
@@ -21,13 +27,13 @@ def get_headers(headers_files):
         elif "dus" in f:
             export_headers_file = f
 
-    # Column Names
-    import_headers_raw = pd.read_excel(os.path.join(columns_folder, import_headers_file), sheet_name=None)
-    export_headers_raw = pd.read_excel(os.path.join(columns_folder, export_headers_file), sheet_name=None)
+    # Column Names (second sheet)
+    import_headers_raw = pd.read_excel(os.path.join(columns_folder, import_headers_file), sheet_name=1)
+    export_headers_raw = pd.read_excel(os.path.join(columns_folder, export_headers_file), sheet_name=1)
     import_export_headers = []
 
     for df in [import_headers_raw, export_headers_raw]:
-        xxx = df[list(df.keys())[1]].iloc[0].tolist()
+        xxx = df.iloc[0].tolist()
         xxx = [x for x in xxx if str(x) != 'nan']
         df_headers = [s.strip() for s in xxx]
         length = len(df_headers)
@@ -40,80 +46,190 @@ def get_headers(headers_files):
     return import_export_headers[0], import_export_headers[1]
 
 
-def get_import_export(import_files, export_files, is_init=False):
+def get_workbook_key(path, cached_key=None):
+    """ mtime, size and md5 of a workbook. The md5 is only computed again when mtime or size changed """
+    stat = os.stat(path)
+    key = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    if cached_key is not None and cached_key.get('mtime') == key['mtime'] and cached_key.get('size') == key['size']:
+        key['md5'] = cached_key.get('md5')
+    else:
+        with open(path, 'rb') as f:
+            key['md5'] = hashlib.md5(f.read()).hexdigest()
+    return key
+
 
+def get_compiled_headers(headers_files):
+    """ Headers and schema (column types) of imports and exports.
+    Reading the workbooks is slow, so the result is saved to Config.HEADERS_CACHE_FILE (columns folder) and reused
+    while the md5 of every workbook and trade_schema.SCHEMA_VERSION are unchanged.
+    Returns import_headers, export_headers, import_schema, export_schema """
     project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
-    # Check whether the specified path exists or not
-    if not os.path.exists(temp_folder):
-        # Create a new directory because it does not exist
-        os.makedirs(temp_folder)
+    cache_path = os.path.join(columns_folder, Config.HEADERS_CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except Exception as e:
+            logger.warning("Headers cache can not be read. Rebuilding it. Error: " + str(e))
 
-    ### ///// UNZIP IMPORT AND EXPORT FILES
-    start = time.process_time()
-    logger.info("Extracting files to temporary folder...")
-    for z in [import_files, export_files]:
-        for f in z:
-            # Create a ZipFile Object and load sample.zip in it
-            with ZipFile(os.path.join(trade_folder, f), 'r') as zipObj:
-               # Extract all the contents of zip file in different directory
-               zipObj.extractall(temp_folder)
-
-    logger.info("Zip extraction Done!" + str((time.process_time() - start)))
-    # 1.5 years take 9 min
-
-    ### ///// READ IMPORTS CSVs (from Temp folder)
+    cached_keys = cache.get('workbooks', {})
+    workbooks = {f: get_workbook_key(os.path.join(columns_folder, f), cached_keys.get(f)) for f in sorted(headers_files)}
+    is_valid = cache.get('schema_version') == SCHEMA_VERSION and sorted(cached_keys) == sorted(workbooks) and \
+        all(cached_keys[f]['md5'] == workbooks[f]['md5'] for f in workbooks)
+
+    if is_valid:
+        logger.info("Headers and schema loaded from cache")
+    else:
+        import_headers, export_headers = get_headers(headers_files)
+        import_schema, export_schema = get_trade_schema(headers_files)
+        cache = {'schema_version': SCHEMA_VERSION, 'import_headers': import_headers, 'export_headers': export_headers,
+                 'import_schema': import_schema, 'export_schema': export_schema}
+
+    if not is_valid or workbooks != cached_keys:
+        cache['workbooks'] = workbooks
+        with open(cache_path + ".tmp", 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(cache_path + ".tmp", cache_path)
+
+    return cache['import_headers'], cache['export_headers'], cache['import_schema'], cache['export_schema']
+
+
+def get_trade_members(trade_files):
+    """ List the .txt members of the trade zip files as (zip_file, member) tuples, split in imports and exports """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    import_members = []
+    export_members = []
+    for f in trade_files:
+        with ZipFile(os.path.join(trade_folder, f), 'r') as zipObj:
+            for member in zipObj.namelist():
+                name = os.path.splitext(os.path.basename(member))[0]
+                extension = os.path.splitext(member)[1]
+                if extension == ".txt" and name.startswith('Import'):
+                    import_members.append((f, member))
+                elif extension == ".txt" and name.startswith('Export'):
+                    export_members.append((f, member))
+    return import_members, export_members
+
+
+def get_fallback_parser_args(parser_args):
+    """ Parsing arguments for a member that does not match the schema: the schema columns are read as text (decimals
+    still come with a comma) and cast afterwards with coerce_to_schema """
+    return {'dtype': {i: str for i in parser_args['dtype']}, 'decimal': ','}
+
+
+def coerce_to_schema(df, parser_args, member):
+    """ Cast the text columns read with get_fallback_parser_args to their schema dtypes. Values that do not fit the
+    dtype (not a number, decimals in an integer column or out of range) become null and are counted """
+    coerced = {}
+    df = df[[i for i in parser_args['usecols'] if i in df.columns]]
+    for i, dtype in parser_args['dtype'].items():
+        if i not in df.columns:
+            continue
+        text = df[i]
+        if dtype in ('str', 'category'):
+            df[i] = text.astype(dtype) if dtype == 'category' else text
+            continue
+        numeric = pd.to_numeric(text.str.replace(',', '.', regex=False), errors='coerce')
+        if pd.api.types.is_integer_dtype(dtype):
+            info = np.iinfo(dtype.lower())
+            numeric = numeric.where((numeric % 1 == 0) & numeric.between(info.min, info.max))
+        is_coerced = numeric.isna() & text.notna()
+        if is_coerced.any():
+            coerced[i] = int(is_coerced.sum())
+        df[i] = numeric.astype(dtype)
+    if len(coerced) > 0:
+        logger.warning("File " + member + ": " + str(sum(coerced.values())) + " values do not match the schema and "
+                       "were set to null. Values by column position: " + str(coerced))
+    return df
+
+
+def read_trade_member(zip_file, member, parser_args=None):
+    """ Parse a zip member by streaming it straight out of the archive into the CSV parser (nothing is extracted
+    to disk and the text is never copied in memory).
+    parser_args: typed parsing arguments (see trade_schema.get_parser_args). If the member does not match the
+    schema it is parsed again as text and cast to the schema (coerce_to_schema). """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    if parser_args is not None:
+        try:
+            with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+                with zipObj.open(member, 'r') as fileObject:
+                    return pd.read_csv(fileObject, sep=";", header=None, encoding='utf-8', **parser_args)
+        except (ValueError, TypeError) as e:
+            logger.warning("File " + member + " does not match the schema. Reading it as text. Error: " + str(e))
+        with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+            with zipObj.open(member, 'r') as fileObject:
+                df = pd.read_csv(fileObject, sep=";", header=None, encoding='utf-8', low_memory=False,
+                                 **get_fallback_parser_args(parser_args))
+        return coerce_to_schema(df, parser_args, member)
+
+    with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+        with zipObj.open(member, 'r') as fileObject:
+            df = pd.read_csv(fileObject, sep=";", header=None, encoding='utf-8', low_memory=False)
+    return df
+
+
+def iter_trade_member(zip_file, member, chunksize=Config.TRADE_CHUNK_SIZE, parser_args=None):
+    """ Same as read_trade_member but yields the member in chunks of (at most) chunksize rows. If a chunk does not
+    match the schema, the rest of the member (from that chunk on) is read as text and cast to the schema """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    if parser_args is None:
+        parser_args = {'low_memory': False}
+    rows = 0
+    try:
+        with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+            with zipObj.open(member, 'r') as fileObject:
+                with pd.read_csv(fileObject, sep=";", header=None, encoding='utf-8', chunksize=chunksize,
+                                 **parser_args) as reader:
+                    for chunk in reader:
+                        rows += len(chunk)
+                        yield chunk
+        return
+    except (ValueError, TypeError) as e:
+        if 'dtype' not in parser_args:
+            raise
+        logger.warning("File " + member + " does not match the schema after " + str(rows) + " rows. Reading the "
+                       "rest as text. Error: " + str(e))
+    with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+        with zipObj.open(member, 'r') as fileObject:
+            with pd.read_csv(fileObject, sep=";", header=None, encoding='utf-8', chunksize=chunksize, skiprows=rows,
+                             **get_fallback_parser_args(parser_args)) as reader:
+                for chunk in reader:
+                    yield coerce_to_schema(chunk, parser_args, member)
+
+
+def get_import_export(import_files, export_files, is_init=False, import_parser_args=None, export_parser_args=None):
+
+    ### ///// READ IMPORTS AND EXPORTS (streamed from the zip files)
     start = time.process_time()
-    all_extracted_files = []
-    for filename in os.listdir(temp_folder):
-        extension = os.path.splitext(filename)[1]
-        if extension == ".txt":
-           all_extracted_files.append(str(filename))
-    logger.info(all_extracted_files)
-
-    import_files_extracted = []
-    export_files_extracted = []
-    for f in all_extracted_files:
-        name = os.path.splitext(f)[0]
-        extension = os.path.splitext(f)[1]
-        if extension == ".txt" and name.startswith('Import'):
-            import_files_extracted.append(str(f))
-        elif extension == ".txt" and name.startswith('Export'):
-            export_files_extracted.append(str(f))
+    import_members, export_members = get_trade_members(import_files + export_files)
+    logger.info([m for z, m in import_members + export_members])
 
     logger.info("Reading files...")
-    imports = pd.DataFrame()
-    exports = pd.DataFrame()
-
-    for f in [import_files_extracted, export_files_extracted]:
-        for i in f:
-            f_path = str(os.path.join(temp_folder, i))
-            with open(f_path, 'rt', encoding='utf-8') as fileObject:
-                temp_txt = StringIO(fileObject.read())
-                df_temp = pd.read_csv(temp_txt, sep=";", header=None, low_memory=False)
+    import_parts = []
+    export_parts = []
+
+    for f in [import_members, export_members]:
+        for z, i in f:
+            is_export = os.path.basename(i).startswith('Export')
+            df_temp = read_trade_member(z, i, export_parser_args if is_export else import_parser_args)
             logger.info("Appending file: " + i)
-            if i.startswith('Export'):
-                exports = pd.concat([exports, df_temp], ignore_index=True, sort=False)
+            if is_export:
+                export_parts.append(df_temp)
             else:
-                imports = pd.concat([imports, df_temp], ignore_index=True, sort=False)
+                import_parts.append(df_temp)
             del df_temp
             logger.info("Append complete.")
-        logger.info("Appending Complete for files: " + ",".join(f))
+        logger.info("Appending Complete for files: " + ",".join([m for z, m in f]))
+
+    imports = concat_frames(import_parts)
+    exports = concat_frames(export_parts)
+    del import_parts, export_parts
 
     logger.info("Created Import file with " + str(len(imports.index)) + " rows")
     logger.info("Created Export file with " + str(len(exports.index)) + " rows")
 
-    for f in import_files_extracted + export_files_extracted:
-        try:
-            logger.info("Removing file " + f)
-            path_del = os.path.join(temp_folder, f)
-            time.sleep(2)
-            os.remove(path_del)
-        except Exception as e:
-            logger.warning("Cannot remove file " + f)
-            logger.error(e)
-
     logger.info("Done! " + str((time.process_time() - start)))
-    # 1.5 years take 9 min
 
     imports.name = "imports"
     exports.name = "exports"
@@ -136,7 +252,23 @@ def set_headers(imports, exports, import_headers, export_headers):
     logger.info("Headers Set...")
     return imports, exports
 
-def get_years_month_to_load(trade_data):
+def get_period_fingerprints(df):
+    """ Content fingerprint of every period_id of a trade frame, independent of the order of the rows: md5 of the
+    number of rows and the sums of the row hashes (all columns, reference_id included). The sums are kept exact by
+    adding the high and low 32 bits of the 64 bit hashes separately """
+    row_hash = pd.util.hash_pandas_object(df, index=False).values
+    hashes = pd.DataFrame({'period_id': df['period_id'].values,
+                           'hash_high': (row_hash >> 32).astype('int64'),
+                           'hash_low': (row_hash & 0xFFFFFFFF).astype('int64')})
+    sums = hashes.groupby('period_id').agg(num_records=('hash_high', 'size'), hash_high=('hash_high', 'sum'),
+                                           hash_low=('hash_low', 'sum'))
+    fingerprint = sums['num_records'].astype(str) + "-" + sums['hash_high'].astype(str) + "-" + sums['hash_low'].astype(str)
+    return fingerprint.map(lambda x: hashlib.md5(x.encode('utf-8')).hexdigest()).rename('fingerprint').reset_index()
+
+def get_years_month_to_load(trade_data, is_fingerprint=True):
+    """ Rows (num_records) and content fingerprint (get_period_fingerprints) of every trade_type and period_id.
+    is_fingerprint: otherwise the fingerprints are None. The loaders skip them: main.py computes them once on the rows
+    that are loaded (after compaction and dedup) """
     dfs = []
 
     logger.info("Getting Months to load...")
@@ -150,12 +282,16 @@ def get_years_month_to_load(trade_data):
 
         logger.info("Extracting subset of columns (Only extract what is needed: trade_type and period_id")
         if len(trade_table) > 0:
-            df = trade_table[['period_id']].copy()
+            df = trade_table[['period_id']].astype(object)
             df['trade_type'] = name
             df_g = df.groupby(['trade_type', 'period_id']).agg(
                 num_records=pd.NamedAgg(column='period_id', aggfunc=pd.Series.count)
             ).reset_index()
             df_g["num_records"] = df_g["num_records"].astype("Int64")
+            if is_fingerprint:
+                df_g = df_g.merge(get_period_fingerprints(trade_table), how='left', on='period_id')
+            else:
+                df_g['fingerprint'] = None
             try:
                 dfs.append(df_g)
             except Exception as e:
@@ -166,59 +302,300 @@ def get_years_month_to_load(trade_data):
     if len(dfs) > 1:
         try:
             output = pd.concat(dfs)
-            output = output[['trade_type', 'period_id', 'num_records']]
+            output = output[['trade_type', 'period_id', 'num_records', 'fingerprint']]
         except Exception as e:
             logger.warning("Could not concatenate ")
             logger.warning(str(e))
-            output = pd.DataFrame(columns=['trade_type', 'period_id', 'num_records'])
-    else:
+            output = pd.DataFrame(columns=['trade_type', 'period_id', 'num_records', 'fingerprint'])
+    elif len(dfs) == 1:
         output = dfs[0]
+    else:
+        # Nothing to load (e.g. no new or changed files)
+        output = pd.DataFrame(columns=['trade_type', 'period_id', 'num_records', 'fingerprint'])
 
     return output
 
-def load_trade_files(files_to_load, is_init):
-    """ Load export and exports into dataframes """
-    # Get import and export headers
-    import_headers, export_headers = get_headers(files_to_load['headers_files'])
-    # Load import and export into a DF (no column names)
-    imports, exports = get_import_export(files_to_load['import_files'], files_to_load['export_files'], is_init)
-    # Set headers for all DFs
-    imports, exports = set_headers(imports, exports, import_headers, export_headers)
-
-    if len(imports) != 0:
-        logger.info("Imports: Adding new columns fecha, period_id and reference_id... ")
-        imports = imports.dropna(subset=['FECTRA'])
-        imports['fecha'] = imports.apply(lambda row: datetime.strptime(str(int(row['FECTRA'])).zfill(8), '%d%m%Y'), axis=1)
-        imports['period_id'] = imports.apply(lambda row: str(row['fecha'].year) + "-" + str(row['fecha'].month), axis=1)
-        imports['reference_id'] = imports.apply(
-            lambda row: str(row['NUMENCRIPTADO'] or 'Unknown') + "-" + str(row['NUMITEM' or 'Unknown']), axis=1)
-        imports[['MEDIDA']] = imports[['MEDIDA']].fillna(value=999)
-        imports[['MEDIDA']] = imports[['MEDIDA']].round().astype(int)
-
-    if len(exports) != 0:
-        logger.info("Exports: Adding new columns fecha, period_id and reference_id... ")
-        exports = exports.dropna(subset=['FECHAACEPT'])
-        # Remove .00000 from:
-        exports[['PAISCIATRANSP']] = exports[['PAISCIATRANSP']].fillna(value=999)
-        exports[['MONEDA']] = exports[['MONEDA']].fillna(value=900)
-        exports[['ADUANA','VIATRANSPORTE','UNIDADMEDIDA']] = exports[['ADUANA','VIATRANSPORTE','UNIDADMEDIDA']].fillna(value=-1)
-        exports[['PAISCIATRANSP','UNIDADMEDIDA','MONEDA','ADUANA','VIATRANSPORTE']] = exports[['PAISCIATRANSP','UNIDADMEDIDA','MONEDA','ADUANA','VIATRANSPORTE']].round().astype(int)
-
-        exports['FECHAACEPT'] = exports['FECHAACEPT'].round().astype(int)
-        # pd.options.mode.chained_assignment = None.
-        exports['fecha'] = exports.apply(
-            lambda row: datetime.strptime(str(row['FECHAACEPT'])[:8].zfill(8), '%d%m%Y'), axis=1)
-        exports['period_id'] = exports.apply(lambda row: str(row['fecha'].year) + "-" + str(row['fecha'].month), axis=1)
-        exports['reference_id'] = exports.apply(
-            lambda row: str(row['NUMEROIDENT'] or 'Unknown') + "-" + str(row['NUMEROITEM' or 'Unknown']), axis=1)
-        # Remove from ADUANA all non integer
-        exports = exports[exports.ADUANA.astype(str).str.isnumeric()]
-
-    logger.info("New Columns added ")
+# Default code for missing values in the export code columns
+EXPORT_CODE_DEFAULTS = {'PAISCIATRANSP': 999, 'MONEDA': 900, 'ADUANA': -1, 'VIATRANSPORTE': -1, 'UNIDADMEDIDA': -1}
+
+# Columns needed to add fecha, period_id and reference_id (always read in projection mode)
+KEY_COLUMNS = {'imports': ['FECTRA', 'NUMENCRIPTADO', 'NUMITEM', 'MEDIDA'],
+               'exports': ['FECHAACEPT', 'NUMEROIDENT', 'NUMEROITEM'] + list(EXPORT_CODE_DEFAULTS.keys())}
+
+def get_fecha_period_id(values, date_str):
+    """ Get fecha and period_id from a column of dates. Each distinct value is parsed only once.
+    date_str: series of distinct values -> series of ddmmyyyy strings """
+    uniques = pd.Series(values.unique())
+    fecha = pd.to_datetime(date_str(uniques), format='%d%m%Y')
+    period_id = fecha.dt.year.astype(str) + "-" + fecha.dt.month.astype(str)
+    fecha_map = pd.Series(fecha.values, index=uniques.values)
+    period_id_map = pd.Series(period_id.values, index=uniques.values)
+    return values.map(fecha_map), values.map(period_id_map)
+
+def get_period_key(fecha):
+    """ Compact period key YYYYMM (int) from fecha (partitioning column of imports and exports) """
+    return (fecha.dt.year * 100 + fecha.dt.month).astype('int32')
+
+def get_reference_id(identifier, item):
+    """ reference_id = <identifier>-<item> (identifiers 0 or empty are replaced with Unknown, missing values are
+    written as nan, as the untyped parser did) """
+    identifier_str = identifier.astype(str).mask(identifier.isna(), 'nan').mask(identifier.isin([0, '']), 'Unknown')
+    return identifier_str + "-" + item.astype(str).mask(item.isna(), 'nan')
+
+# Line items whose identifier is below this limit get a packed key (identifier * 2^16 + item), the others a hash
+PACKED_KEY_LIMIT = 2 ** 47
+
+def get_reference_key(identifier, item, rows):
+    """ Compact int64 key of a line item (same item as reference_id), vectorized:
+    - identifier * 2^16 + item (items are 16 bit), zero or positive.
+    - Identifiers too big to pack: 64 bit hash of both columns.
+    - Missing identifier or item: 64 bit hash of the whole row (rows), so that these rows do not share a key.
+    Hashes are made negative so that they do not collide with a packed key """
+    is_missing = (identifier.isna() | item.isna()).to_numpy()
+    identifier = identifier.fillna(0).astype('int64')
+    item = item.fillna(0).astype('int64')
+    is_packed = ~is_missing & (identifier >= 0) & (identifier < PACKED_KEY_LIMIT) & (item >= 0) & (item < 2 ** 16)
+    reference_key = identifier * 2 ** 16 + item
+    if not is_packed.all():
+        hashed = pd.util.hash_pandas_object(pd.DataFrame({'identifier': identifier, 'item': item}), index=False).values
+        if is_missing.any():
+            hashed = np.where(is_missing, pd.util.hash_pandas_object(rows, index=False).values, hashed)
+        reference_key = reference_key.where(is_packed, -(hashed >> 1).astype('int64') - 1)
+    return reference_key
+
+def transform_imports(imports):
+    """ Clean the text columns and add fecha, period_id, reference_id, period_key and reference_key to an imports frame
+    (with headers) """
+    imports = clean_text_columns(imports.dropna(subset=['FECTRA']))
+    imports['fecha'], imports['period_id'] = get_fecha_period_id(
+        imports['FECTRA'], lambda x: x.astype('int64').astype(str).str.zfill(8))
+    imports['reference_id'] = get_reference_id(imports['NUMENCRIPTADO'], imports['NUMITEM'])
+    imports['period_key'] = get_period_key(imports['fecha'])
+    imports['reference_key'] = get_reference_key(imports['NUMENCRIPTADO'], imports['NUMITEM'], imports)
+    imports['MEDIDA'] = imports['MEDIDA'].fillna(value=999).round().astype(int)
+    return imports
+
+def transform_exports(exports):
+    """ Clean the text columns and add fecha, period_id, reference_id, period_key and reference_key to an exports frame
+    (with headers) """
+    exports = clean_text_columns(exports.dropna(subset=['FECHAACEPT']))
+    # Fill missing codes and remove .00000 (one pass for all code columns)
+    code_columns = list(EXPORT_CODE_DEFAULTS.keys()) + ['FECHAACEPT']
+    exports[code_columns] = exports[code_columns].fillna(value=EXPORT_CODE_DEFAULTS).round().astype(int)
+
+    exports['fecha'], exports['period_id'] = get_fecha_period_id(
+        exports['FECHAACEPT'], lambda x: x.astype(str).str[:8].str.zfill(8))
+    exports['reference_id'] = get_reference_id(exports['NUMEROIDENT'], exports['NUMEROITEM'])
+    exports['period_key'] = get_period_key(exports['fecha'])
+    exports['reference_key'] = get_reference_key(exports['NUMEROIDENT'], exports['NUMEROITEM'], exports)
+    # Remove from ADUANA all non integer
+    exports = exports[exports.ADUANA.astype(str).str.isnumeric()]
+    return exports
+
+def load_trade_files(files_to_load, is_init, is_cache=False):
+    """ Load export and exports into dataframes.
+    is_cache: members are parsed one by one and saved to (or loaded from) the Parquet cache """
+    import_headers, export_headers, import_schema, export_schema = get_compiled_headers(files_to_load['headers_files'])
+    import_parser_args = get_parser_args(import_headers, import_schema)
+    export_parser_args = get_parser_args(export_headers, export_schema)
+
+    if is_cache:
+        import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+        imports = load_members_cached(import_members, 'imports', import_headers, import_parser_args,
+                                      lambda z, m: parse_trade_member(z, m, 'imports', import_headers, import_parser_args))
+        exports = load_members_cached(export_members, 'exports', export_headers, export_parser_args,
+                                      lambda z, m: parse_trade_member(z, m, 'exports', export_headers, export_parser_args))
+    else:
+        # Load import and export into a DF (no column names)
+        imports, exports = get_import_export(files_to_load['import_files'], files_to_load['export_files'], is_init,
+                                             import_parser_args=import_parser_args,
+                                             export_parser_args=export_parser_args)
+        # Set headers for all DFs
+        imports, exports = set_headers(imports, exports, import_headers, export_headers)
+
+        if len(imports) != 0:
+            logger.info("Imports: Adding new columns fecha, period_id and reference_id... ")
+            imports = transform_imports(imports)
+
+        if len(exports) != 0:
+            logger.info("Exports: Adding new columns fecha, period_id and reference_id... ")
+            exports = transform_exports(exports)
+
+        logger.info("New Columns added ")
 
     imports.name = "imports"
     exports.name = "exports"
 
-    years_month_to_load = get_years_month_to_load([imports, exports])
+    years_month_to_load = get_years_month_to_load([imports, exports], is_fingerprint=False)
+
+    return years_month_to_load, imports, exports
+
+def load_trade_files_chunked(files_to_load, on_chunk, chunksize=Config.TRADE_CHUNK_SIZE):
+    """ Bounded-memory version of load_trade_files.
+    Every chunk is parsed, gets its headers and new columns (fecha, period_id and reference_id) and is handed to
+    on_chunk(trade_type, chunk) before the next chunk is read. Only the number of records per period is kept. """
+    import_headers, export_headers, import_schema, export_schema = get_compiled_headers(files_to_load['headers_files'])
+    import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+
+    num_records = {}
+    for trade_type, members, headers, schema, transform in [
+            ('imports', import_members, import_headers, import_schema, transform_imports),
+            ('exports', export_members, export_headers, export_schema, transform_exports)]:
+        # Chunks are always typed (otherwise the same column could get different types in different chunks)
+        parser_args = get_parser_args(headers, schema)
+        for z, m in members:
+            logger.info("Reading file " + m + " in chunks of " + str(chunksize) + " rows...")
+            for chunk in iter_trade_member(z, m, chunksize=chunksize, parser_args=parser_args):
+                chunk.columns = headers
+                chunk = transform(chunk)
+                if len(chunk) == 0:
+                    continue
+                for period_id, n in chunk['period_id'].value_counts().items():
+                    num_records[(trade_type, period_id)] = num_records.get((trade_type, period_id), 0) + n
+                on_chunk(trade_type, chunk)
+            logger.info("File " + m + " complete.")
+
+    years_month_to_load = pd.DataFrame([(k[0], k[1], v) for k, v in num_records.items()],
+                                       columns=['trade_type', 'period_id', 'num_records'])
+    years_month_to_load["num_records"] = years_month_to_load["num_records"].astype("Int64")
+
+    return years_month_to_load
+
+def parse_trade_member(zip_file, member, trade_type, headers, parser_args=None):
+    """ Parse one zip member, set its headers and add the new columns (runs in a worker process) """
+    df = read_trade_member(zip_file, member, parser_args)
+    df.columns = headers
+    if len(df) != 0:
+        df = transform_imports(df) if trade_type == 'imports' else transform_exports(df)
+    return df
+
+def bootstrap_manifest(files_to_load):
+    """ Manifest of the trade members on disk, for the first run (no manifest yet). Every member is taken as loaded
+    (only the last year is loaded in that run) and its periods are unknown (None) until it is parsed again """
+    import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+    members_state = scan_members(import_members + export_members)
+    manifest = {}
+    for trade_type, members in [('imports', import_members), ('exports', export_members)]:
+        for z, m in members:
+            key = get_manifest_key(z, m)
+            manifest[key] = dict(members_state[key], trade_type=trade_type, periods=None)
+    logger.info("Trade manifest started with " + str(len(manifest)) + " files")
+    return manifest
+
+def load_changed_trade_files(files_to_load, manifest, is_cache=False):
+    """ Incremental version of load_trade_files (any number of years).
+    Only members that are new or changed (CRC32 or size different from the manifest) are parsed, plus the unchanged
+    members that produced any of their periods (a period is always loaded complete). Members with unknown periods
+    (bootstrap_manifest) are parsed with the other members of their zip file.
+    is_cache: members are loaded from (or saved to) the Parquet cache.
+    Returns years_month_to_load, imports, exports, the updated manifest and the periods of the parsed members
+    {trade_type: [period_id]} (previous and new ones) """
+    import_headers, export_headers, import_schema, export_schema = get_compiled_headers(files_to_load['headers_files'])
+    import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+    members_state = scan_members(import_members + export_members)
+
+    removed = get_removed_members(manifest, import_members + export_members)
+    if len(removed) > 0:
+        logger.warning("Members not found in the trade files (their periods are kept in the DB): " + str(removed))
+    new_manifest = {k: v for k, v in manifest.items() if k not in removed}
+
+    trade_data = []
+    changed_periods_dict = {}
+    for trade_type, members, headers, schema in [('imports', import_members, import_headers, import_schema),
+                                                 ('exports', export_members, export_headers, export_schema)]:
+        parser_args = get_parser_args(headers, schema)
+        to_parse = [(z, m) for z, m in members
+                    if is_member_changed(manifest, get_manifest_key(z, m), members_state[get_manifest_key(z, m)])]
+        logger.info(trade_type + ": " + str(len(to_parse)) + " of " + str(len(members)) + " files are new or changed")
+
+        parts = []
+        parsed = []
+        changed_periods = set()
+        while len(to_parse) > 0:
+            if is_cache:
+                frames = load_members_cached(to_parse, trade_type, headers, parser_args,
+                                             lambda z, m: parse_trade_member(z, m, trade_type, headers, parser_args),
+                                             is_concat=False)
+            else:
+                frames = [parse_trade_member(z, m, trade_type, headers, parser_args) for z, m in to_parse]
+            for (z, m), df in zip(to_parse, frames):
+                key = get_manifest_key(z, m)
+                periods = sorted(df['period_id'].unique().tolist()) if len(df) != 0 else []
+                if key in manifest:
+                    changed_periods.update(manifest[key]['periods'] or [])
+                changed_periods.update(periods)
+                new_manifest[key] = dict(members_state[key], trade_type=trade_type, periods=periods)
+                if len(df) != 0:
+                    parts.append(df)
+                parsed.append((z, m))
+            # Unchanged members that share a period with the parsed ones
+            to_parse = [x for x in get_members_with_periods(manifest, members, changed_periods,
+                                                            zip_files=set(z for z, m in parsed)) if x not in parsed]
+
+        df = concat_frames(parts)
+        df.name = trade_type
+        trade_data.append(df)
+        changed_periods_dict[trade_type] = sorted(changed_periods)
+
+    imports, exports = trade_data
+    years_month_to_load = get_years_month_to_load([imports, exports], is_fingerprint=False)
+    return years_month_to_load, imports, exports, new_manifest, changed_periods_dict
+
+def load_trade_files_parallel(files_to_load, is_init, workers=Config.TRADE_WORKERS):
+    """ Multi-process version of load_trade_files.
+    Imports and exports members are parsed at the same time by a pool of workers. Each worker returns a frame with
+    headers and new columns and the frames are concatenated once at the end. """
+    import_headers, export_headers, import_schema, export_schema = get_compiled_headers(files_to_load['headers_files'])
+    import_parser_args = get_parser_args(import_headers, import_schema)
+    export_parser_args = get_parser_args(export_headers, export_schema)
+    import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+
+    logger.info("Parsing " + str(len(import_members) + len(export_members)) + " files with " + str(workers) + " workers...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        import_futures = [executor.submit(parse_trade_member, z, m, 'imports', import_headers, import_parser_args)
+                          for z, m in import_members]
+        export_futures = [executor.submit(parse_trade_member, z, m, 'exports', export_headers, export_parser_args)
+                          for z, m in export_members]
+        import_parts = [f.result() for f in import_futures]
+        export_parts = [f.result() for f in export_futures]
+
+    imports = concat_frames(import_parts)
+    exports = concat_frames(export_parts)
+    del import_parts, export_parts
+    logger.info("Created Import file with " + str(len(imports.index)) + " rows")
+    logger.info("Created Export file with " + str(len(exports.index)) + " rows")
 
-    return years_month_to_load, imports, exports
\ No newline at end of file
+    imports.name = "imports"
+    exports.name = "exports"
+
+    years_month_to_load = get_years_month_to_load([imports, exports], is_fingerprint=False)
+
+    return years_month_to_load, imports, exports
+
+def load_trade_projection(files_to_load, trade_type, columns):
+    """ Projection mode: read only the columns a report needs (plus KEY_COLUMNS) from every imports or exports
+    member. Returns a lean DF with the new columns (fecha, period_id and reference_id) """
+    import_headers, export_headers, import_schema, export_schema = get_compiled_headers(files_to_load['headers_files'])
+    import_members, export_members = get_trade_members(files_to_load['import_files'] + files_to_load['export_files'])
+    if trade_type == 'imports':
+        headers, schema, members, transform = import_headers, import_schema, import_members, transform_imports
+    else:
+        headers, schema, members, transform = export_headers, export_schema, export_members, transform_exports
+
+    columns = list(dict.fromkeys(KEY_COLUMNS[trade_type] + columns))
+    parser_args = get_parser_args(headers, schema, columns)
+    logger.info("Reading " + str(len(columns)) + " of " + str(len(headers)) + " " + trade_type + " columns...")
+
+    parts = []
+    for z, m in members:
+        df = read_trade_member(z, m, parser_args)
+        df.columns = [headers[i] for i in df.columns]
+        # All columns are read if the member does not match the schema
+        df = df[columns]
+        if len(df) != 0:
+            parts.append(transform(df))
+
+    df = concat_frames(parts)
+    df.name = trade_type
+    logger.info("Projection of " + trade_type + " complete: " + str(len(df)) + " rows")
+    return df
@@ -1,12 +1,15 @@
 import os
 from io import StringIO
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import re
 import time
 from datetime import timedelta
 import shutil
 from decimal import *
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure Tolveet Logger
 from config import TolveetLogger, Config, MAIN_DIR
@@ -23,6 +26,69 @@ def get_folders(temp_folder):
     temp_folder = os.path.join(trade_folder, temp_folder)
     return project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder
 
+def concat_frames(frames, columns=None):
+    """ Concatenate a list of DFs at once. Collect the parts in a list and call this function instead of growing a
+    DF with pd.concat inside a loop (every call copies everything loaded so far) """
+    if len(frames) == 0:
+        return pd.DataFrame(columns=columns)
+    # Categories differ between parts (and pd.concat would turn those columns into object). Use the union.
+    for c in frames[0].select_dtypes(include='category').columns:
+        if all(c in df.columns and isinstance(df[c].dtype, pd.CategoricalDtype) for df in frames):
+            categories = union_categoricals([df[c] for df in frames], ignore_order=True).categories
+            for df in frames:
+                df[c] = df[c].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+def clean_text_columns(df):
+    """ Remove new lines and leading/trailing whitespace from the text columns of df (object and category).
+    Categories are cleaned once per distinct value """
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(s.cat.categories) == 'string':
+            categories = s.cat.categories.str.replace(r'[\r\n]', '', regex=True).str.strip()
+            if categories.is_unique:
+                df[c] = s.cat.rename_categories(categories)
+            else:
+                df[c] = pd.Categorical(s.astype(object).str.replace(r'[\r\n]', '', regex=True).str.strip())
+        elif s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == 'string':
+            df[c] = s.str.replace(r'[\r\n]', '', regex=True).str.strip()
+    return df
+
+def get_compact_int_type(s):
+    """ Smallest integer type (int8, int16 or int32, nullable if s is) that holds s. None if s has negative values
+    (their row hashes, and so the period fingerprints, depend on the integer width) or is already that small """
+    if s.isna().all() or s.min() < 0:
+        return None
+    for t in ['int8', 'int16', 'int32']:
+        if s.max() <= np.iinfo(t).max:
+            compact_type = t.capitalize() if isinstance(s.dtype, pd.api.extensions.ExtensionDtype) else t
+            return None if np.dtype(t).itemsize >= s.dtype.itemsize else compact_type
+    return None
+
+def compact_frame(df, string_columns=('period_id', 'reference_id')):
+    """ Reduce the memory of a trade DF in place: text columns with few distinct values (at most
+    Config.COMPACT_CATEGORY_RATIO of the rows) become categorical and the rest (and string_columns) Arrow-backed
+    strings; non-negative integer columns are downcast. Values, .csv output and row hashes do not change (floats are
+    kept as they are) """
+    if df is None or len(df) == 0:
+        return df
+    memory_before = df.memory_usage(deep=True).sum()
+    for c in df.columns:
+        s = df[c]
+        if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == 'string':
+            if c not in string_columns and s.nunique() <= Config.COMPACT_CATEGORY_RATIO * len(s):
+                df[c] = s.astype('category')
+            else:
+                df[c] = s.astype('string[pyarrow]')
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            compact_type = get_compact_int_type(s)
+            if compact_type is not None:
+                df[c] = s.astype(compact_type)
+    memory_after = df.memory_usage(deep=True).sum()
+    logger.info("Compact " + str(getattr(df, 'name', '')) + ": memory " + str(round(memory_before / 2**20, 1)) +
+                " MB -> " + str(round(memory_after / 2**20, 1)) + " MB")
+    return df
+
 def get_years_month_loaded(conn, schema_name):
     dfs = []
     for table_name in ['imports', 'exports']:
@@ -181,7 +247,7 @@ def get_currency(currency_files):
     project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
     logger.info("Reading currencies...")
     # currency_list_name = []
-    currency_df = pd.DataFrame()
+    currency_parts = []
     for f in currency_files:
         name = os.path.splitext(f)[0]
         temp_names = name.split('_')
@@ -193,8 +259,9 @@ def get_currency(currency_files):
         currency_raw.columns = ['currency_date', 'to_clp']
         currency_raw['currency_code'] = currency_code
 
-        currency_df = pd.concat([currency_df,  currency_raw], ignore_index=True, sort=False)
+        currency_parts.append(currency_raw)
 
+    currency_df = concat_frames(currency_parts)
     currency_df = currency_df[["currency_code", "currency_date", "to_clp"]]
 
     # generate daily forecast (naive method).
@@ -211,7 +278,7 @@ def get_currency(currency_files):
 
     currency_df.dropna(how='all', inplace=True)
 
-    currency_df_forecast = pd.DataFrame()
+    forecast_parts = []
     for f in Config.CURRENCIES:
         # f = 'usd'
         tmp_forecast = pd.DataFrame({
@@ -220,7 +287,8 @@ def get_currency(currency_files):
             'to_clp': float('nan')},
             columns=["currency_code", "currency_date", "to_clp"]
         )
-        currency_df_forecast = pd.concat([currency_df_forecast, tmp_forecast])
+        forecast_parts.append(tmp_forecast)
+    currency_df_forecast = concat_frames(forecast_parts)
 
     # make same data type for concat
     currency_df_forecast = currency_df_forecast.astype(currency_df.dtypes.to_dict())
@@ -260,19 +328,64 @@ def generate_temp_csv(imports, exports, schema_name):
 
     logger.info("Saving Imports and Exports as .csv....")
     time.sleep(1)
+    # Rows in load order for BULK INSERT
     if len(imports) > 0:
-        imports.to_csv(os.path.join(temp_folder, schema_name+".imports.csv"), index=False, sep=";", header=False)
+        sort_for_load(imports).to_csv(os.path.join(temp_folder, schema_name+".imports.csv"), index=False, sep=";", header=False,
+                                       lineterminator='\n')
     if len(exports) > 0:
-        exports.to_csv(os.path.join(temp_folder, schema_name+".exports.csv"), index=False, sep=";", header=False)
+        sort_for_load(exports).to_csv(os.path.join(temp_folder, schema_name+".exports.csv"), index=False, sep=";", header=False,
+                                       lineterminator='\n')
     logger.info(".csv saved.")
 
 
 
+def reset_trade_chunks():
+    """ Remove chunks left by a previous run (chunked mode) """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    chunks_folder = os.path.join(temp_folder, "chunks")
+    if os.path.exists(chunks_folder):
+        shutil.rmtree(chunks_folder)
+    os.makedirs(chunks_folder)
+
+def spill_trade_chunk(chunk, trade_type, schema_name):
+    """ Append a parsed chunk to one .csv per period (chunked mode). Periods are selected after the whole
+    file has been read, see generate_temp_csv_from_chunks """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    chunks_folder = os.path.join(temp_folder, "chunks")
+    for period_id, df in chunk.groupby('period_id', sort=False):
+        f = schema_name + "." + trade_type + "." + period_id + ".csv"
+        df.to_csv(os.path.join(chunks_folder, f), index=False, sep=";", header=False, mode='a', lineterminator='\n')
+
+def generate_temp_csv_from_chunks(periods_to_load_dict, schema_name):
+    """ Chunked mode version of generate_temp_csv. Concatenates the .csv of the periods to load """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    chunks_folder = os.path.join(temp_folder, "chunks")
+
+    for t, periods in periods_to_load_dict.items():
+        f = schema_name + "." + t + ".csv"
+        if os.path.exists(os.path.join(temp_folder, f)):
+            logger.info("File " + f + " exist. Removing...")
+            os.remove(os.path.join(temp_folder, f))
+        chunk_files = [schema_name + "." + t + "." + p + ".csv" for p in periods]
+        chunk_files = [c for c in chunk_files if os.path.exists(os.path.join(chunks_folder, c))]
+        if len(chunk_files) == 0:
+            continue
+        logger.info("Saving " + t + " as .csv from " + str(len(chunk_files)) + " periods....")
+        with open(os.path.join(temp_folder, f), 'wb') as output:
+            for c in chunk_files:
+                with open(os.path.join(chunks_folder, c), 'rb') as chunk_file:
+                    shutil.copyfileobj(chunk_file, output)
+
+    shutil.rmtree(chunks_folder)
+    logger.info(".csv saved.")
+
+
 def col_to_str(df_dict):
     logger.info("Columns to String...")
     for dim in df_dict.values():
         all_columns = list(dim)  # Creates list of all column headers
         dim[all_columns] = dim[all_columns].astype(str)
+        clean_text_columns(dim)
 
 def drop_db_objects(conn, raw_connection, tables_to_drop, schema_name, sql_drop_commands):
     logger.info("Dropping objects created in query...")
@@ -288,16 +401,104 @@ def drop_db_objects(conn, raw_connection, tables_to_drop, schema_name, sql_drop_
     for t in ['DROP SCHEMA  IF EXISTS '+schema_name, 'CREATE SCHEMA '+schema_name]:
         conn.execute_sql_batch(logger, log_prefix='', raw_connection=raw_connection, query_parsed=[t], debug=False)
 
-def recreate_db(conn, raw_connection, imports, exports,dimensions_dict, currency_converter, schema_name, sql_init_commands, if_exists='append'):
+def get_period_key_from_id(period_id):
+    """ period_id (YYYY-M) to period_key (YYYYMM) """
+    year, month = str(period_id).split('-')
+    return int(year) * 100 + int(month)
+
+def get_period_id_from_key(period_key):
+    """ period_key (YYYYMM) to period_id (YYYY-M) """
+    return str(int(period_key) // 100) + "-" + str(int(period_key) % 100)
+
+def delete_moved_rows(conn, schema_name, table_name, moved_keys, chunk_size=1000):
+    """ Delete the previous copies of line items that were loaded again in another period. moved_keys: reference_key
+    and the period_key of the previous copy (key_index.get_moved_keys) """
+    for period_key, keys in moved_keys.groupby('period_key')['reference_key']:
+        keys = keys.tolist()
+        for start in range(0, len(keys), chunk_size):
+            conn._execute_command("DELETE FROM {0}.{1} WHERE period_key = {2} AND reference_key IN ({3});".format(
+                schema_name, table_name, period_key, ", ".join(str(k) for k in keys[start:start + chunk_size])))
+        logger.info(table_name + ": " + str(len(keys)) + " rows moved to another period deleted from " +
+                    get_period_id_from_key(period_key))
+
+def get_storage_commands(schema_name, is_partitioned=False, is_columnstore=False, table_names=('imports', 'exports')):
+    """ SQL commands for the storage profile of the fact tables, as a list of (table_name, command). Commands of a
+    table run after its period_key is NOT NULL and before its nonclustered indexes are created. Commands with no
+    table_name run first.
+    - is_partitioned: partition by period_key, one partition per month (Config.PARTITION_FIRST_YEAR to
+      Config.PARTITION_LAST_YEAR). Clustered index on period_key (nonclustered indexes are aligned with it).
+    - is_columnstore: clustered columnstore index (on the partition scheme if is_partitioned) """
+    commands = []
+    if is_partitioned:
+        commands = get_partition_function_commands()
+    for t in table_names:
+        on_partition = " ON {0}(period_key)".format(Config.PARTITION_SCHEME) if is_partitioned else ""
+        if is_columnstore:
+            commands.append((t, "CREATE CLUSTERED COLUMNSTORE INDEX cci_{1} ON {0}.{1}{2};".format(
+                schema_name, t, on_partition)))
+        elif is_partitioned:
+            commands.append((t, "CREATE CLUSTERED INDEX cix_{1}_period_key ON {0}.{1} (period_key){2};".format(
+                schema_name, t, on_partition)))
+    return commands
+
+def get_partition_function_commands():
+    """ Partition function and scheme of period_key """
+    boundaries = [str(y * 100 + m) for y in range(Config.PARTITION_FIRST_YEAR, Config.PARTITION_LAST_YEAR + 1)
+                  for m in range(1, 13)]
+    commands = [(None, c) for c in [
+                "IF EXISTS (SELECT * FROM sys.partition_schemes WHERE name = '{0}') "
+                "DROP PARTITION SCHEME {0};".format(Config.PARTITION_SCHEME),
+                "IF EXISTS (SELECT * FROM sys.partition_functions WHERE name = '{0}') "
+                "DROP PARTITION FUNCTION {0};".format(Config.PARTITION_FUNCTION),
+                "CREATE PARTITION FUNCTION {0} (int) AS RANGE RIGHT FOR VALUES ({1});".format(
+                    Config.PARTITION_FUNCTION, ", ".join(boundaries)),
+                "CREATE PARTITION SCHEME {0} AS PARTITION {1} ALL TO ([PRIMARY]);".format(
+                    Config.PARTITION_SCHEME, Config.PARTITION_FUNCTION)]]
+    return commands
+
+def get_partitioned_keys(conn, period_keys):
+    """ period_keys that have their own partition (RANGE RIGHT, one boundary per month). The partitions before the
+    first boundary and after the last one (Config.PARTITION_FIRST_YEAR to Config.PARTITION_LAST_YEAR) are shared by
+    several periods: their periods are deleted and inserted instead of truncated and switched in """
+    boundaries = conn.get_partition_boundaries(Config.PARTITION_FUNCTION)
+    positions = {b: i for i, b in enumerate(boundaries)}
+    partitioned_keys = set()
+    for k in set(period_keys):
+        next_key = k + 1 if k % 100 < 12 else (k // 100 + 1) * 100 + 1
+        i = positions.get(k)
+        if i is not None and i + 1 < len(boundaries) and boundaries[i + 1] <= next_key:
+            partitioned_keys.add(k)
+    if len(partitioned_keys) < len(set(period_keys)):
+        logger.warning("Periods without their own partition: " +
+                       str(sorted(set(period_keys) - partitioned_keys)) + ". Their rows are deleted and inserted.")
+    return partitioned_keys
+
+# SQL Server types of the columns added to imports and exports (csv_load.transform_imports/transform_exports)
+DERIVED_COLUMN_TYPES = {'fecha': 'date', 'period_id': 'varchar(10) NOT NULL', 'reference_id': 'varchar(255) NOT NULL',
+                        'period_key': 'int NOT NULL', 'reference_key': 'bigint NOT NULL'}
+# SQL Server types of currency_converter (to_* columns are float)
+CURRENCY_COLUMN_TYPES = {'currency_code': 'varchar(10)', 'currency_date': 'date'}
+
+def get_column_types(import_types, export_types):
+    """ {table: {column: SQL Server type}} for the typed tables. import_types and export_types: types of the DIN/DUS
+    columns (schema registry), the derived columns are added """
+    return {'imports': {**import_types, **DERIVED_COLUMN_TYPES},
+            'exports': {**export_types, **DERIVED_COLUMN_TYPES},
+            'currency_converter': CURRENCY_COLUMN_TYPES}
+
+def recreate_db(conn, raw_connection, imports, exports,dimensions_dict, currency_converter, schema_name, sql_init_commands, if_exists='append',
+                storage_commands=None, column_types=None, workers=Config.DDL_WORKERS, is_load_ledger=False):
+    """ column_types: {table: {column: SQL Server type}} (see get_column_types). Imports, exports and currencies are
+    created with their final types, so no column has to be converted after the load.
+    workers: the SQL commands on different tables run in parallel on up to workers connections (1: one by one)
+    is_load_ledger: create the (empty) load ledger """
+    column_types = {} if column_types is None else column_types
 
     try:
         for df in [imports, exports, currency_converter]:
             logger.info("Creating empty DB schemas for " + df.name)
-            df_head = df.head(10).copy()
-            all_columns = list(df_head)  # Creates list of all column headers
-            df_head[all_columns] = df_head[all_columns].astype(str)
-            # logger.info(df_head.head(0))
-            conn.write_table_from_dataframe(df=df_head.head(0), table_name=df.name, schema=schema_name, if_exists=if_exists)
+            conn.create_table(df=df.head(0), table_name=df.name, schema=schema_name,
+                              column_types=column_types.get(df.name))
         logger.info("DB schema created for imports and exports.")
 
         for df in list(dimensions_dict.values()):
@@ -310,10 +511,41 @@ def recreate_db(conn, raw_connection, imports, exports,dimensions_dict, currency
     except Exception as e:
         logger.error("Error: %s" % e)
 
+    if storage_commands is not None:
+        # Clustered index (partitioned or columnstore) of each table right before its first index is created
+        commands = [c for t, c in storage_commands if t is None]
+        for c in sql_init_commands:
+            for t, p in storage_commands:
+                if t is not None and p not in commands and c.lower().startswith('create index') and \
+                        (" on " + schema_name + "." + t + " ") in c.lower():
+                    commands.append(p)
+            commands.append(c)
+        sql_init_commands = commands
+
     logger.info("Running initialization SQL commands...")
-    conn.execute_sql_batch(logger, log_prefix='', raw_connection=raw_connection, query_parsed=sql_init_commands, debug=False)
+    if workers > 1:
+        conn.execute_sql_parallel(logger, log_prefix='', conn=conn, query_parsed=sql_init_commands,
+                                  schema_name=schema_name, workers=workers)
+    else:
+        conn.execute_sql_batch(logger, log_prefix='', raw_connection=raw_connection, query_parsed=sql_init_commands,
+                               debug=False)
+
+    if is_load_ledger:
+        # load_ledger imports data_process
+        from utils.load_ledger import create_ledger
+        try:
+            create_ledger(conn, schema_name)
+        except Exception as e:
+            logger.error("Error: %s" % e)
+
+def is_csv_to_load(df, table_name, schema_name, temp_folder):
+    if df is None:
+        return os.path.exists(os.path.join(temp_folder, schema_name + "." + table_name + ".csv"))
+    return len(df) != 0
 
 def copy_csv_into_db(conn, raw_connection, imports, exports, schema_name, currency_converter=None, dimensions_dict=None, is_remove_tmp=True):
+    """ Load dimensions, currencies, imports and exports. Returns whether imports and exports were loaded (False when
+    there was nothing to load or the bulk load failed) """
 
     project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
 
@@ -322,43 +554,260 @@ def copy_csv_into_db(conn, raw_connection, imports, exports, schema_name, curren
     for k, v in dimensions_dict.items():
         # Truncate dimensions first (to prevent duplication).
         conn._truncate_table(table=k, schema=schema_name)
-        conn.copy_from_file(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=v, table_name=k, path_to_csv=temp_folder)
+        conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=v, table_name=k, path_to_csv=temp_folder)
 
     ## Copy currencies
     logger.info("Copying currencies....")
     # Truncate first (to prevent duplication).
     conn._truncate_table(table=currency_converter.name, schema=schema_name)
-    conn.copy_from_file(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=currency_converter, table_name=currency_converter.name, path_to_csv=temp_folder)
+    conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=currency_converter, table_name=currency_converter.name, path_to_csv=temp_folder)
 
     ## Copy imports and exports
-    if len(imports) != 0:
+    # In chunked mode there is no DF (imports/exports are None) and the .csv generated from the chunks is used.
+    if is_csv_to_load(imports, "imports", schema_name, temp_folder):
         logger.info("Copying imports to DB....")
-        conn.copy_from_file(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=imports, table_name=imports.name, path_to_csv=temp_folder)
-        logger.info("Copy imports to DB complete. ")
-        is_loaded_imports = True
+        is_loaded_imports = copy_trade_table(conn, imports, "imports", schema_name, temp_folder)
+        if is_loaded_imports:
+            logger.info("Copy imports to DB complete. ")
+        else:
+            logger.error("Copy imports to DB failed. ")
     else:
         logger.warning("No imports to load to DB. ")
         is_loaded_imports = False
 
-    if len(exports) != 0:
+    if is_csv_to_load(exports, "exports", schema_name, temp_folder):
         logger.info("Copying exports to DB....")
-        conn.copy_from_file(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=exports, table_name=exports.name, path_to_csv=temp_folder)
-        logger.info("Copy exports to DB complete. ")
-        is_loaded_exports = True
+        is_loaded_exports = copy_trade_table(conn, exports, "exports", schema_name, temp_folder)
+        if is_loaded_exports:
+            logger.info("Copy exports to DB complete. ")
+        else:
+            logger.error("Copy exports to DB failed. ")
     else:
         logger.warning("No exports to load to DB. ")
         is_loaded_exports = False
 
-    if is_remove_tmp:
+    if is_remove_tmp and os.path.exists(temp_folder):
+        shutil.rmtree(temp_folder)
+
+    return is_loaded_imports, is_loaded_exports
+
+def sort_for_load(df):
+    """ Rows in clustered key order (period_key) and by fecha, so that columnstore segments can be eliminated by
+    period and date """
+    return df.sort_values(['period_key', 'fecha'], kind='stable')
+
+def get_incoming_rows(df, table_name, schema_name, temp_folder):
+    """ Number of rows to load (lines of the .csv file when there is no DF) """
+    if df is not None:
+        return len(df)
+    with open(os.path.join(temp_folder, schema_name + "." + table_name + ".csv"), 'rb') as f:
+        return sum(1 for line in f)
+
+def copy_trade_table(conn, df, table_name, schema_name, temp_folder):
+    """ Bulk load imports or exports choosing how to maintain the secondary indexes:
+    - rebuild: when the incoming rows are at least Config.INDEX_REBUILD_RATIO of the rows in the table the indexes are
+      disabled, the rows are loaded with TABLOCK in batches of Config.BULK_INSERT_BATCH_SIZE and the indexes rebuilt.
+    - keep: small incremental loads maintain the indexes.
+    Clustered columnstore tables are always loaded in batches of Config.COLUMNSTORE_BATCH_SIZE (rows are compressed
+    directly instead of going to the deltastore) and reorganized after the load.
+    Every phase is timed """
+    start = time.time()
+    incoming_rows = get_incoming_rows(df, table_name, schema_name, temp_folder)
+    existing_rows = conn.get_row_count(table=table_name, schema=schema_name)
+    is_rebuild = incoming_rows >= Config.INDEX_REBUILD_RATIO * existing_rows
+    is_columnstore = conn.is_columnstore(table=table_name, schema=schema_name)
+    batch_size = Config.BULK_INSERT_BATCH_SIZE if is_rebuild else None
+    if is_columnstore:
+        batch_size = Config.COLUMNSTORE_BATCH_SIZE
+    if df is not None and Config.BULK_SINK != 'csv':
+        df = sort_for_load(df)
+    logger.info(table_name + ": " + str(incoming_rows) + " incoming rows, " + str(existing_rows) + " existing rows. "
+                "Index strategy: " + ("rebuild" if is_rebuild else "keep"))
+
+    if is_rebuild:
+        start_phase = time.time()
+        conn.set_secondary_indexes(table=table_name, schema=schema_name, is_enabled=False)
+        logger.info(table_name + ": indexes disabled in " + str(round(time.time() - start_phase, 2)) + " seconds.")
+
+    try:
+        start_phase = time.time()
+        is_loaded = conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=df,
+                                   table_name=table_name, path_to_csv=temp_folder, is_tablock=is_rebuild,
+                                   batch_size=batch_size)
+        logger.info(table_name + ": rows loaded in " + str(round(time.time() - start_phase, 2)) + " seconds.")
+
+        if is_columnstore:
+            start_phase = time.time()
+            conn.reorganize_columnstore(table=table_name, schema=schema_name)
+            logger.info(table_name + ": columnstore reorganized in " + str(round(time.time() - start_phase, 2)) + " seconds.")
+    finally:
+        # Indexes are rebuilt even if the load fails (they would stay disabled for the next runs and the reports)
+        if is_rebuild:
+            start_phase = time.time()
+            conn.set_secondary_indexes(table=table_name, schema=schema_name, is_enabled=True)
+            logger.info(table_name + ": indexes rebuilt in " + str(round(time.time() - start_phase, 2)) + " seconds.")
+
+    logger.info(table_name + ": load complete in " + str(round(time.time() - start, 2)) + " seconds.")
+    return is_loaded
+
+def replace_table(conn, df, table_name, schema_name, temp_folder):
+    """ Truncate a table and load df into it """
+    conn._truncate_table(table=table_name, schema=schema_name)
+    return conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=df, table_name=table_name,
+                          path_to_csv=temp_folder)
+
+def load_partition(conn, df, table_name, period_id, schema_name, temp_folder, is_partitioned=False):
+    """ Bulk load the rows of one period into their own staging table. Returns the staging table name and whether the
+    load succeeded """
+    stage_name = table_name + "_stage_" + re.sub("[^0-9a-zA-Z]+", "_", str(period_id))
+    if is_partitioned:
+        conn.create_staging_table(table=table_name, stage=stage_name, schema=schema_name,
+                                  partition_scheme=Config.PARTITION_SCHEME, partition_column='period_key',
+                                  is_columnstore=conn.is_columnstore(table=table_name, schema=schema_name))
+        df = sort_for_load(df)
+    else:
+        conn.create_staging_table(table=table_name, stage=stage_name, schema=schema_name)
+    # The csv sink (copy_from_file) reuses an existing .csv
+    csv_file = os.path.join(temp_folder, schema_name + "." + stage_name + ".csv")
+    if os.path.exists(csv_file):
+        os.remove(csv_file)
+    is_loaded = conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=df,
+                               table_name=stage_name, path_to_csv=temp_folder)
+    return stage_name, is_loaded, get_period_key_from_id(period_id)
+
+def attach_partitions(conn, table_name, partitions, schema_name, partitioned_keys=(), is_upsert=False):
+    """ Attach the staging tables [(stage_name, is_loaded, period_key)] of a table. Returns True if every partition was
+    attached (otherwise the periods of the table stay in progress and are loaded again).
+    partitioned_keys: switch the staging tables of these period_keys in (their partitions of table must be empty, see
+    get_partitioned_keys).
+    is_upsert: MERGE every staging table on reference_key (one transaction per period, safe to retry) """
+    is_attached = len(partitions) > 0
+    for stage_name, is_loaded, period_key in partitions:
+        if is_loaded and is_upsert:
+            start = time.time()
+            counts = conn.merge_staging_table(table=table_name, stage=stage_name, schema=schema_name,
+                                              key_column='reference_key', period_column='period_key',
+                                              period_key=period_key)
+            logger.info(table_name + " " + str(period_key) + " upserted in " + str(round(time.time() - start, 2)) +
+                        " seconds. Inserted: " + str(counts['INSERT']) + ", updated: " + str(counts['UPDATE']) +
+                        ", deleted: " + str(counts['DELETE']))
+        elif is_loaded and period_key in partitioned_keys:
+            conn.attach_staging_table(table=table_name, stage=stage_name, schema=schema_name,
+                                      partition_function=Config.PARTITION_FUNCTION, partition_key=period_key)
+        elif is_loaded:
+            conn.attach_staging_table(table=table_name, stage=stage_name, schema=schema_name)
+        else:
+            logger.error("Partition " + stage_name + " was not loaded. Dropping it...")
+            is_attached = False
+            conn._execute_command("DROP TABLE IF EXISTS " + schema_name + "." + stage_name + ";")
+    return is_attached
+
+def drop_duplicated_keys(df, table_name, key_column='reference_key'):
+    """ Keep the last row of every key (MERGE needs one source row per key) """
+    is_duplicated = df.duplicated(subset=[key_column], keep='last')
+    if is_duplicated.any():
+        logger.warning(table_name + ": " + str(is_duplicated.sum()) + " rows with a duplicated " + key_column +
+                       " are not loaded.")
+        df = df[~is_duplicated]
+    return df
+
+def copy_partitioned_into_db(conn, imports, exports, schema_name, currency_converter=None, dimensions_dict=None,
+                             is_remove_tmp=True, workers=Config.DB_LOAD_WORKERS, is_partitioned=False, is_upsert=False):
+    """ Parallel version of copy_csv_into_db.
+    Imports and exports are split by period_id and every partition is bulk loaded into its own staging table, on its
+    own pooled connection (up to workers at the same time). Dimensions and currencies are loaded by the same pool.
+    Then the staging tables are attached to imports and exports (both tables at the same time).
+    is_partitioned: imports and exports are partitioned by period_key and staging tables are switched in (periods with
+    their own partition, see get_partitioned_keys).
+    is_upsert: staging tables are merged on reference_key instead (periods do not have to be deleted first) """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    os.makedirs(temp_folder, exist_ok=True)
+
+    start = time.time()
+    side_tables = dict(dimensions_dict)
+    side_tables[currency_converter.name] = currency_converter
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        logger.info("Copying dimensions and currencies....")
+        side_futures = [executor.submit(replace_table, conn, v, k, schema_name, temp_folder) for k, v in side_tables.items()]
+
+        partitioned_keys = set()
+        if is_partitioned:
+            partitioned_keys = get_partitioned_keys(conn, [get_period_key_from_id(p) for df in [imports, exports]
+                                                           if len(df) > 0 for p in df['period_id'].unique()])
+        partition_futures = {}
+        for df, table_name in [(imports, "imports"), (exports, "exports")]:
+            partition_futures[table_name] = []
+            if len(df) > 0:
+                logger.info("Copying " + table_name + " to DB by period_id....")
+                if is_upsert:
+                    df = drop_duplicated_keys(df, table_name)
+                partition_futures[table_name] = [executor.submit(load_partition, conn, part, table_name, period_id,
+                                                                 schema_name, temp_folder,
+                                                                 get_period_key_from_id(period_id) in partitioned_keys)
+                                                 for period_id, part in df.groupby('period_id', sort=True)]
+            else:
+                logger.warning("No " + table_name + " to load to DB. ")
+
+        for f in side_futures:
+            f.result()
+        partitions = {k: [f.result() for f in v] for k, v in partition_futures.items()}
+    logger.info("Partitions loaded in " + str(round(time.time() - start, 2)) + " seconds.")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        attach_futures = {k: executor.submit(attach_partitions, conn, k, v, schema_name, partitioned_keys, is_upsert)
+                          for k, v in partitions.items()}
+        is_loaded_imports = attach_futures['imports'].result()
+        is_loaded_exports = attach_futures['exports'].result()
+    logger.info("Partitions attached in " + str(round(time.time() - start, 2)) + " seconds.")
+
+    for table_name in ['imports', 'exports']:
+        if conn.is_columnstore(table=table_name, schema=schema_name):
+            conn.reorganize_columnstore(table=table_name, schema=schema_name)
+
+    if is_remove_tmp and os.path.exists(temp_folder):
         shutil.rmtree(temp_folder)
 
     return is_loaded_imports, is_loaded_exports
 
-def check_for_incomplete_periods(incremental_loads, trade_type, schema_name, conn, raw_connection):
-    # Select years and months with a missmatch (in number of records) compared to what has been loaded.
+def load_side_table(conn, df, table_name, schema_name):
+    """ Replace the content of a lean side table (projection mode). The table is created from the DF if needed """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    logger.info("Loading side table " + table_name + "....")
+    conn.write_table_from_dataframe(df=df.head(0).copy(), table_name=table_name, schema=schema_name, if_exists='append')
+    conn._truncate_table(table=table_name, schema=schema_name)
+    # The csv sink (copy_from_file) reuses an existing .csv
+    csv_file = os.path.join(temp_folder, schema_name + "." + table_name + ".csv")
+    if os.path.exists(csv_file):
+        os.remove(csv_file)
+    is_loaded = conn.bulk_load(logger=logger, log_prefix='', conn=conn, schema_name=schema_name, df=df,
+                               table_name=table_name, path_to_csv=temp_folder)
+    if os.path.exists(csv_file):
+        os.remove(csv_file)
+    return is_loaded
+
+def check_for_incomplete_periods(incremental_loads, trade_type, schema_name, conn, raw_connection, changed_periods_dict=None,
+                                 is_partitioned=False, is_delete=True, on_delete=None):
+    # Select years and months with a missmatch (in number of records or content fingerprint) compared to what has been
+    # loaded. Fingerprints are compared when both are known (load ledger and get_years_month_to_load).
+    # is_delete=False (upsert loads): the periods are only returned, their rows are merged later.
+    # on_delete(trade_type, periods) is called before the rows of the periods are deleted (e.g. load ledger).
+    is_mismatch = incremental_loads['num_records_x'] != incremental_loads['num_records_y']
+    if 'fingerprint_x' in incremental_loads.columns and 'fingerprint_y' in incremental_loads.columns:
+        is_fingerprint = incremental_loads['fingerprint_x'].notna() & incremental_loads['fingerprint_y'].notna()
+        is_mismatch = is_mismatch | (is_fingerprint &
+                                     (incremental_loads['fingerprint_x'] != incremental_loads['fingerprint_y']))
+    else:
+        is_fingerprint = pd.Series(False, index=incremental_loads.index)
+    # Periods of changed files (see trade_manifest) are replaced even if the number of records is the same (unless
+    # their fingerprint did not change).
+    if changed_periods_dict is not None:
+        for t in trade_type:
+            is_mismatch = is_mismatch | ((incremental_loads['trade_type'] == t) & ~is_fingerprint &
+                                         incremental_loads['period_id'].isin(changed_periods_dict.get(t, [])))
     periods_to_delete = incremental_loads[(~incremental_loads['num_records_x'].isnull()) &
                                           (~incremental_loads['num_records_y'].isnull()) &
-                                          (incremental_loads['num_records_x'] != incremental_loads['num_records_y'])]
+                                          is_mismatch]
 
     periods_to_delete_dict = {}
     for t in trade_type:
@@ -372,12 +821,20 @@ def check_for_incomplete_periods(incremental_loads, trade_type, schema_name, con
     logger.info(periods_to_delete_dict)
 
     # DELETE: Remove records from DB
-    for t in trade_type:
-        if len(periods_to_delete_dict[t]) != 0:
-            lst = periods_to_delete_dict[t]
-            lst_str = "('{0}".format("', '".join(lst)) + "')"
+    for t in trade_type if is_delete else []:
+        if len(periods_to_delete_dict[t]) != 0 and on_delete is not None:
+            on_delete(t, periods_to_delete_dict[t])
+        period_keys = [get_period_key_from_id(p) for p in periods_to_delete_dict[t]]
+        partitioned_keys = get_partitioned_keys(conn, period_keys) if is_partitioned and len(period_keys) != 0 else set()
+        if len(partitioned_keys) != 0:
+            # Partition-level replace (see get_storage_commands)
+            conn.truncate_partitions(table=t, partition_function=Config.PARTITION_FUNCTION, schema=schema_name,
+                                     partition_keys=sorted(partitioned_keys))
+        if len(period_keys) > len(partitioned_keys):
+            lst = [str(k) for k in period_keys if k not in partitioned_keys]
+            lst_str = "(" + ", ".join(lst) + ")"
             query = "DELETE FROM {0}.{1} " \
-                    "WHERE period_id IN {2};".format(schema_name, t, lst_str)
+                    "WHERE period_key IN {2};".format(schema_name, t, lst_str)
             conn.execute_sql_batch(logger=logger, log_prefix='', raw_connection=raw_connection, query_parsed=[query],
                                    debug=True)
     return periods_to_delete_dict
\ No newline at end of file
@@ -0,0 +1,110 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from utils.data_process import get_folders
+
+# Configure Tolveet Logger
+from config import TolveetLogger, Config, MAIN_DIR
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+# Keys (reference_key) of the rows loaded into imports and exports, one sorted int64 array per period:
+#   <key index>/<trade_type>/<period_key>.npy
+# Incoming rows are checked against it in memory (binary search, no DB round trip):
+# - A key repeated in the incoming rows (e.g. overlapping releases of the trade files) is kept once (last row).
+# - A key already loaded in another period (one that is not in the incoming rows, which replace their periods) is a
+#   line item that moved: after the incoming rows are loaded, the previous copy is deleted (get_moved_keys).
+# The array of a period is replaced after the period is loaded (only if the load succeeded). Periods loaded before the
+# index existed (or in chunked mode) are not in it. clear_key_index() removes everything (the DB is initialized).
+
+
+def get_key_index_folder(trade_type=None):
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    key_index_folder = os.path.join(trade_folder, Config.FOLDER_KEY_INDEX)
+    return key_index_folder if trade_type is None else os.path.join(key_index_folder, trade_type)
+
+
+def clear_key_index():
+    key_index_folder = get_key_index_folder()
+    if os.path.exists(key_index_folder):
+        logger.info("Removing key index " + key_index_folder)
+        shutil.rmtree(key_index_folder)
+
+
+def save_period_keys(trade_type, period_key, keys):
+    folder = get_key_index_folder(trade_type)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, str(period_key) + ".npy")
+    # np.save adds .npy to the temporary name
+    np.save(path + ".tmp", np.unique(np.asarray(keys, dtype='int64')))
+    os.replace(path + ".tmp.npy", path)
+
+
+def load_period_keys(trade_type, exclude_period_keys=()):
+    """ Keys of all the periods in the index except exclude_period_keys, sorted, and the period_key of every key """
+    folder = get_key_index_folder(trade_type)
+    exclude = set(str(k) for k in exclude_period_keys)
+    files = [f for f in sorted(os.listdir(folder)) if f.endswith('.npy') and os.path.splitext(f)[0] not in exclude] \
+        if os.path.exists(folder) else []
+    if len(files) == 0:
+        return np.array([], dtype='int64'), np.array([], dtype='int64')
+    arrays = [np.load(os.path.join(folder, f)) for f in files]
+    keys = np.concatenate(arrays)
+    period_keys = np.repeat([int(os.path.splitext(f)[0]) for f in files], [len(a) for a in arrays])
+    order = np.argsort(keys, kind='stable')
+    return keys[order], period_keys[order]
+
+
+def get_positions_in_sorted(keys, sorted_keys):
+    """ Vectorized search of keys in a sorted array (binary search). Returns their positions (-1 if not found) """
+    if len(sorted_keys) == 0:
+        return np.full(len(keys), -1)
+    position = np.searchsorted(sorted_keys, keys)
+    position[position == len(sorted_keys)] = 0
+    return np.where(sorted_keys[position] == keys, position, -1)
+
+
+def drop_duplicated_rows(df, trade_type):
+    """ Keep the last row of every key repeated in the incoming rows of a trade_type. Returns the rows to load """
+    if df is None or len(df) == 0:
+        return df
+    name = getattr(df, 'name', trade_type)
+    is_repeated = df.duplicated(subset=['reference_key'], keep='last')
+    if is_repeated.any():
+        logger.warning(trade_type + ": dropping " + str(is_repeated.sum()) + " repeated rows.")
+        df = df[~is_repeated]
+        df.name = name
+    return df
+
+
+def get_moved_keys(df, trade_type):
+    """ Keys of df already loaded in another period (not in df). Returns reference_key and the period_key of the
+    previous copy """
+    if df is None or len(df) == 0:
+        return pd.DataFrame(columns=['reference_key', 'period_key'])
+    keys = df['reference_key'].to_numpy(dtype='int64')
+    loaded_keys, loaded_period_keys = load_period_keys(trade_type, exclude_period_keys=df['period_key'].unique())
+    position = get_positions_in_sorted(keys, loaded_keys)
+    is_moved = position >= 0
+    if is_moved.any():
+        logger.warning(trade_type + ": " + str(is_moved.sum()) + " rows were loaded before in another period.")
+    return pd.DataFrame({'reference_key': keys[is_moved], 'period_key': loaded_period_keys[position[is_moved]]})
+
+
+def remove_period_keys(trade_type, moved_keys):
+    """ Remove moved keys (get_moved_keys) from the periods of their previous copies """
+    for period_key, keys in moved_keys.groupby('period_key')['reference_key']:
+        path = os.path.join(get_key_index_folder(trade_type), str(period_key) + ".npy")
+        if os.path.exists(path):
+            save_period_keys(trade_type, period_key, np.setdiff1d(np.load(path), keys.to_numpy(dtype='int64')))
+
+
+def update_key_index(df, trade_type, period_ids):
+    """ Replace the keys of the periods just loaded (period_ids) with the keys of their rows in df """
+    if df is None or len(df) == 0:
+        return
+    df = df[df['period_id'].isin(period_ids)]
+    for period_key, keys in df.groupby('period_key', sort=True)['reference_key']:
+        save_period_keys(trade_type, period_key, keys.to_numpy(dtype='int64'))
+    logger.info("Key index: " + trade_type + " keys saved for " + str(df['period_key'].nunique()) + " periods.")
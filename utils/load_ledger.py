@@ -0,0 +1,129 @@
+import pandas as pd
+from sqlalchemy.sql import text
+from utils.data_process import get_years_month_loaded, get_period_key_from_id
+
+# Configure Tolveet Logger
+from config import TolveetLogger, Config, MAIN_DIR
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+# The load ledger (<schema_name>.<Config.LOAD_LEDGER_TABLE>) has one row per trade_type and period loaded into imports
+# and exports. The incremental planner reads it instead of counting the rows of imports and exports.
+# - Before the rows of a period are deleted or loaded its num_records is set to -1 (in progress). A run that stops
+#   half way leaves -1, which never matches the rows to load, so the period is deleted and loaded again.
+# - After the load num_records is set to the rows of the period in the DB (counted only for the loaded periods).
+# - The content fingerprint of the loaded rows (csv_load.get_period_fingerprints) is kept with the count, so that a
+#   period whose content changed with the same number of rows is reloaded (check_for_incomplete_periods).
+# - The first time (no ledger) it is filled from one count of imports and exports (without fingerprints).
+
+def get_ledger_name(schema_name):
+    return schema_name + "." + Config.LOAD_LEDGER_TABLE
+
+
+def create_ledger(conn, schema_name):
+    """ Create the ledger if it does not exist. Returns True if it was created """
+    if conn.read_query("SELECT OBJECT_ID('" + get_ledger_name(schema_name) + "', 'U') AS object_id;")['object_id'].notna()[0]:
+        return False
+    logger.info("Creating load ledger " + get_ledger_name(schema_name) + "...")
+    conn._execute_command(f'''CREATE TABLE {get_ledger_name(schema_name)} (
+                                trade_type varchar(10) NOT NULL,
+                                period_id varchar(10) NOT NULL,
+                                period_key int NOT NULL,
+                                num_records bigint NOT NULL,
+                                fingerprint varchar(64) NULL,
+                                source_members varchar(max) NULL,
+                                loaded_at datetime2 NOT NULL DEFAULT SYSUTCDATETIME(),
+                                CONSTRAINT pk_{Config.LOAD_LEDGER_TABLE} PRIMARY KEY (trade_type, period_key)
+                            );''')
+    return True
+
+
+def get_years_month_loaded_from_ledger(conn, schema_name):
+    """ Periods loaded (trade_type, period_id, num_records, fingerprint) from the ledger. The ledger is created and filled from
+    imports and exports (get_years_month_loaded) if it does not exist. Nothing is loaded if the schema does not exist
+    (new DB, see data_process.recreate_db) """
+    try:
+        if create_ledger(conn, schema_name):
+            years_month_loaded = get_years_month_loaded(conn, schema_name)
+            for trade_type, df in years_month_loaded.groupby('trade_type'):
+                set_periods(conn, schema_name, trade_type, df['period_id'].tolist(), df['num_records'].tolist())
+        query = "SELECT trade_type, period_id, num_records, fingerprint FROM {0} " \
+                "ORDER BY trade_type, period_key;".format(get_ledger_name(schema_name))
+        output = conn.read_query(query)
+    except Exception as e:
+        logger.warning("Could not get loaded dates from load ledger: " + get_ledger_name(schema_name))
+        output = pd.DataFrame(columns=['trade_type', 'period_id', 'num_records', 'fingerprint'])
+    output["num_records"] = output["num_records"].astype("Int64")
+    return output
+
+
+def get_source_members(manifest, trade_type, period_id):
+    """ Zip members that produced a period according to the trade manifest """
+    if manifest is None:
+        return None
+    return ",".join(sorted(k for k, v in manifest.items()
+                           if v.get('trade_type') == trade_type and period_id in (v.get('periods') or []))) or None
+
+
+def get_fingerprints(years_month_to_load, trade_type, period_ids):
+    """ Fingerprints of periods from years_month_to_load (None if unknown) """
+    if 'fingerprint' not in years_month_to_load.columns:
+        return None
+    fingerprints = years_month_to_load[years_month_to_load['trade_type'] == trade_type].set_index('period_id')['fingerprint']
+    return [None if pd.isna(fingerprints.get(p)) else fingerprints.get(p) for p in period_ids]
+
+
+def set_periods(conn, schema_name, trade_type, period_ids, num_records, fingerprints=None, manifest=None):
+    """ Replace the ledger rows of the periods of a trade_type (one transaction) """
+    if len(period_ids) == 0:
+        return
+    fingerprints = [None] * len(period_ids) if fingerprints is None else fingerprints
+    rows = [{'trade_type': trade_type, 'period_id': p, 'period_key': get_period_key_from_id(p), 'num_records': int(n),
+             'fingerprint': f, 'source_members': get_source_members(manifest, trade_type, p)}
+            for p, n, f in zip(period_ids, num_records, fingerprints)]
+    period_keys = ", ".join(str(r['period_key']) for r in rows)
+    with conn.get_connection(is_transaction=True) as con:
+        con.execute(text("DELETE FROM {0} WHERE trade_type = :trade_type AND period_key IN ({1});".format(
+            get_ledger_name(schema_name), period_keys)), {'trade_type': trade_type})
+        con.execute(text("INSERT INTO {0} (trade_type, period_id, period_key, num_records, fingerprint, source_members) "
+                         "VALUES (:trade_type, :period_id, :period_key, :num_records, :fingerprint, :source_members);"
+                         .format(get_ledger_name(schema_name))), rows)
+
+
+def set_periods_in_progress(conn, schema_name, trade_type, period_ids):
+    """ Mark periods as being deleted or loaded (num_records -1) """
+    logger.info("Load ledger: " + trade_type + " periods in progress: " + str(period_ids))
+    set_periods(conn, schema_name, trade_type, period_ids, [-1] * len(period_ids))
+
+
+def get_period_records(conn, schema_name, trade_type, period_ids):
+    """ Rows in the DB of periods. Only those periods are counted (period_key index or partition) """
+    period_keys = [get_period_key_from_id(p) for p in period_ids]
+    query = "SELECT period_key, COUNT(*) AS num_records FROM {0}.{1} WHERE period_key IN ({2}) " \
+            "GROUP BY period_key;".format(schema_name, trade_type, ", ".join(str(k) for k in period_keys))
+    counts = conn.read_query(query).set_index('period_key')['num_records']
+    return [int(counts.get(k, 0)) for k in period_keys]
+
+
+def set_periods_loaded(conn, schema_name, trade_type, period_ids, fingerprints=None, manifest=None):
+    """ Record the rows in the DB of the periods just loaded """
+    if len(period_ids) == 0:
+        return
+    num_records = get_period_records(conn, schema_name, trade_type, period_ids)
+    set_periods(conn, schema_name, trade_type, period_ids, num_records, fingerprints, manifest)
+    logger.info("Load ledger: " + trade_type + " periods loaded: " + str(dict(zip(period_ids, num_records))))
+
+
+def set_periods_recounted(conn, schema_name, trade_type, period_ids):
+    """ Update the rows in the DB of periods whose rows were deleted without loading them (e.g. line items that moved
+    to another period). Their fingerprint and source members are kept """
+    if len(period_ids) == 0:
+        return
+    num_records = get_period_records(conn, schema_name, trade_type, period_ids)
+    rows = [{'trade_type': trade_type, 'period_key': get_period_key_from_id(p), 'num_records': n}
+            for p, n in zip(period_ids, num_records)]
+    with conn.get_connection(is_transaction=True) as con:
+        con.execute(text("UPDATE {0} SET num_records = :num_records, loaded_at = SYSUTCDATETIME() "
+                         "WHERE trade_type = :trade_type AND period_key = :period_key;"
+                         .format(get_ledger_name(schema_name))), rows)
+    logger.info("Load ledger: " + trade_type + " periods recounted: " + str(dict(zip(period_ids, num_records))))
@@ -0,0 +1,170 @@
+import pandas as pd
+import os
+import json
+import time
+import shutil
+import hashlib
+from zipfile import ZipFile
+from utils.data_process import get_folders, concat_frames
+
+# Configure Tolveet Logger
+from config import TolveetLogger, Config, MAIN_DIR
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+# Parsed and enriched zip members are cached as Parquet, partitioned by trade_type and period_id:
+#   <cache>/trade_type=imports/period_id=2021-3/<member key>.parquet
+# The member key is built from the CRC and size of the zip member (central directory) and from the schema used to
+# parse it. Invalidation rules:
+# - A member whose CRC or size changed gets a new key. The entry of the previous version is removed.
+# - A change of headers, column types or CACHE_VERSION (bump it when the new columns change) changes every key.
+# - Entries whose files are missing are ignored and removed.
+# - Least recently used entries are evicted when the cache is bigger than Config.PARQUET_CACHE_MAX_MB.
+# - clear_cache() (main.py --rebuild-cache) removes everything.
+
+CACHE_VERSION = 5
+INDEX_FILE = "index.json"
+
+
+def get_cache_folder():
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    return os.path.join(trade_folder, Config.FOLDER_PARQUET_CACHE)
+
+
+def get_schema_key(headers, parser_args):
+    """ Short hash of everything that defines how a member is parsed """
+    schema = json.dumps([CACHE_VERSION, headers, parser_args], sort_keys=True, default=str)
+    return hashlib.md5(schema.encode('utf-8')).hexdigest()[:8]
+
+
+def get_member_key(zip_info, schema_key):
+    return "{:08x}-{}-{}".format(zip_info.CRC, zip_info.file_size, schema_key)
+
+
+def load_index():
+    """ Index of cached members: {member key: entry} """
+    index_path = os.path.join(get_cache_folder(), INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning("Parquet cache index can not be read. Starting an empty cache. Error: " + str(e))
+        return {}
+
+
+def save_index(index):
+    cache_folder = get_cache_folder()
+    os.makedirs(cache_folder, exist_ok=True)
+    index_path = os.path.join(cache_folder, INDEX_FILE)
+    with open(index_path + ".tmp", 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def remove_entry(index, key):
+    cache_folder = get_cache_folder()
+    for f in index[key]['files']:
+        path = os.path.join(cache_folder, f)
+        if os.path.exists(path):
+            os.remove(path)
+    del index[key]
+
+
+def clear_cache():
+    """ Remove the whole cache (it is rebuilt on the next load) """
+    logger.info("Removing Parquet cache...")
+    cache_folder = get_cache_folder()
+    if os.path.exists(cache_folder):
+        shutil.rmtree(cache_folder)
+
+
+def read_cached_member(index, key):
+    """ Read a cached member. Returns None when it is not cached """
+    if key not in index:
+        return None
+    cache_folder = get_cache_folder()
+    entry = index[key]
+    if not all(os.path.exists(os.path.join(cache_folder, f)) for f in entry['files']):
+        logger.warning("Parquet cache files missing for " + entry['member'] + ". Invalidating...")
+        remove_entry(index, key)
+        return None
+    parts = []
+    for f in entry['files']:
+        df = pd.read_parquet(os.path.join(cache_folder, f))
+        # Empty categories are stored with a null type and come back as object
+        for c in entry['category_columns']:
+            if not isinstance(df[c].dtype, pd.CategoricalDtype):
+                df[c] = df[c].astype('category')
+        parts.append(df)
+    df = concat_frames(parts)
+    entry['last_access'] = time.time()
+    return df
+
+
+def write_cached_member(index, key, zip_file, member, trade_type, df):
+    """ Save a parsed and enriched member, one Parquet file per period """
+    cache_folder = get_cache_folder()
+
+    # Previous versions of the same member are stale
+    for k in [k for k, v in index.items() if v['zip_file'] == zip_file and v['member'] == member and k != key]:
+        logger.info("Member " + member + " changed. Invalidating previous cache entry...")
+        remove_entry(index, k)
+
+    files = []
+    num_bytes = 0
+    for period_id, df_period in df.groupby('period_id', sort=False):
+        f = os.path.join("trade_type=" + trade_type, "period_id=" + str(period_id), key + ".parquet")
+        os.makedirs(os.path.join(cache_folder, os.path.dirname(f)), exist_ok=True)
+        df_period.reset_index(drop=True).to_parquet(os.path.join(cache_folder, f), index=False)
+        files.append(f)
+        num_bytes += os.path.getsize(os.path.join(cache_folder, f))
+
+    index[key] = {'zip_file': zip_file,
+                  'member': member,
+                  'trade_type': trade_type,
+                  'periods': [str(p) for p in df['period_id'].unique()],
+                  'files': files,
+                  'category_columns': list(df.select_dtypes(include='category').columns),
+                  'bytes': num_bytes,
+                  'last_access': time.time()}
+
+
+def evict_lru(index, max_bytes=Config.PARQUET_CACHE_MAX_MB * 1024 * 1024):
+    """ Remove least recently used entries until the cache fits in max_bytes """
+    total_bytes = sum(v['bytes'] for v in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_access']):
+        if total_bytes <= max_bytes:
+            break
+        logger.info("Parquet cache is full. Evicting " + index[key]['member'] + "...")
+        total_bytes -= index[key]['bytes']
+        remove_entry(index, key)
+
+
+def load_members_cached(members, trade_type, headers, parser_args, parse_member, is_concat=True):
+    """ Get the enriched frame of every member, from the cache when the member did not change.
+    parse_member(zip_file, member) parses a member that is not cached.
+    is_concat: return one frame (otherwise the list of frames, one per member) """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    schema_key = get_schema_key(headers, parser_args)
+    index = load_index()
+
+    parts = []
+    for z, m in members:
+        with ZipFile(os.path.join(trade_folder, z), 'r') as zipObj:
+            key = get_member_key(zipObj.getinfo(m), schema_key)
+        df = read_cached_member(index, key)
+        if df is not None:
+            logger.info("File " + m + " loaded from Parquet cache.")
+        else:
+            logger.info("File " + m + " not cached. Parsing...")
+            df = parse_member(z, m)
+            if len(df) != 0:
+                write_cached_member(index, key, z, m, trade_type, df)
+        parts.append(df)
+
+    evict_lru(index)
+    save_index(index)
+
+    return concat_frames(parts) if is_concat else parts
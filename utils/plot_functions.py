@@ -3,6 +3,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from utils.data_process import concat_frames
 
 def aggregate_canola_imports(input_df, country_name='TODOS'):
     input_df = input_df.fillna(0)
@@ -30,6 +31,7 @@ def aggregate_canola_imports(input_df, country_name='TODOS'):
 def generate_missing_dates(df, date_from, date_to):
 
     unique_countries = df['pais_nombre_origen'].unique()
+    parts = [df]
 
     for c in unique_countries:
         missing_dates_df = pd.DataFrame({
@@ -55,8 +57,9 @@ def generate_missing_dates(df, date_from, date_to):
 
         missing_dates_df = missing_dates_df.astype(df.dtypes.to_dict())
 
+        parts.append(missing_dates_df)
 
-        df = pd.concat([df, missing_dates_df], ignore_index=True, sort=False)
+    df = concat_frames(parts)
 
     df['fecha_month'] = pd.to_datetime(
         df['fecha_month'],
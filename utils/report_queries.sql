@@ -14,69 +14,15 @@ SELECT
     --DATEFROMPARTS(substring(RIGHT(REPLICATE('0', 8) + i."FECTRA", 8), 5, 4), 
     --substring(RIGHT(REPLICATE('0', 8) + i."FECTRA", 8), 3, 2), 
     --substring(RIGHT(REPLICATE('0', 8) + i."FECTRA", 8), 1, 2)) AS FECHA,
-    CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."CIF", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS CIF_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."CIF_ITEM", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS CIF_ITEM_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."FOB", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS FOB_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."CANT_MERC", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS CANT_MERC_MOD
-        ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."PRE_UNIT", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS PRE_UNIT_MOD
-        ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."FLETE", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS FLETE_MOD
-        ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."MON_OTRO", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS MON_OTRO_MOD
-        ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."SEGURO", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS SEGURO_MOD
-        ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(i."TOT_PESO", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS TOT_PESO_MOD
+    CAST( COALESCE(i."CIF", 0) AS NUMERIC(15,2)) AS CIF_MOD
+    ,CAST( COALESCE(i."CIF_ITEM", 0) AS NUMERIC(15,2)) AS CIF_ITEM_MOD
+    ,CAST( COALESCE(i."FOB", 0) AS NUMERIC(15,2)) AS FOB_MOD
+    ,CAST( COALESCE(i."CANT_MERC", 0) AS NUMERIC(15,2)) AS CANT_MERC_MOD
+        ,CAST( COALESCE(i."PRE_UNIT", 0) AS NUMERIC(15,2)) AS PRE_UNIT_MOD
+        ,CAST( COALESCE(i."FLETE", 0) AS NUMERIC(15,2)) AS FLETE_MOD
+        ,CAST( COALESCE(i."MON_OTRO", 0) AS NUMERIC(15,2)) AS MON_OTRO_MOD
+        ,CAST( COALESCE(i."SEGURO", 0) AS NUMERIC(15,2)) AS SEGURO_MOD
+        ,CAST( COALESCE(i."TOT_PESO", 0) AS NUMERIC(15,2)) AS TOT_PESO_MOD
     ,aca.aduana_nombre AS aduana_nombre
     ,accc.clausula_compra_nombre AS clausula_compra_nombre
     ,acdi.documento_ingreso_nombre AS documento_ingreso_nombre
@@ -166,62 +112,14 @@ GO
 
 WITH CTE AS (
     SELECT 
-    CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."CANTIDADMERCANCIA", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS CANTIDADMERCANCIA_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."FOBUS", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS FOBUS_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."FOBUNITARIO", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS FOBUNITARIO_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."VALORFLETE", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS VALORFLETE_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."TOTALVALORFOB", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS TOTALVALORFOB_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."PESOBRUTOTOTAL", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS PESOBRUTOTOTAL_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."VALORLIQUIDORETORNO", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS VALORLIQUIDORETORNO_MOD
-    ,CAST( COALESCE(NULLIF(
-                /* Clean anythign that is not a number */
-                canola.RemoveNonAlphaCharacters(
-                /* In Chile commas are dots */
-                REPLACE(e."VALORCLAUSULAVENTA", ',', '.')
-                )
-                ,''),'0') AS NUMERIC(15,2)) AS VALORCLAUSULAVENTA_MOD
+    CAST( COALESCE(e."CANTIDADMERCANCIA", 0) AS NUMERIC(15,2)) AS CANTIDADMERCANCIA_MOD
+    ,CAST( COALESCE(e."FOBUS", 0) AS NUMERIC(15,2)) AS FOBUS_MOD
+    ,CAST( COALESCE(e."FOBUNITARIO", 0) AS NUMERIC(15,2)) AS FOBUNITARIO_MOD
+    ,CAST( COALESCE(e."VALORFLETE", 0) AS NUMERIC(15,2)) AS VALORFLETE_MOD
+    ,CAST( COALESCE(e."TOTALVALORFOB", 0) AS NUMERIC(15,2)) AS TOTALVALORFOB_MOD
+    ,CAST( COALESCE(e."PESOBRUTOTOTAL", 0) AS NUMERIC(15,2)) AS PESOBRUTOTOTAL_MOD
+    ,CAST( COALESCE(e."VALORLIQUIDORETORNO", 0) AS NUMERIC(15,2)) AS VALORLIQUIDORETORNO_MOD
+    ,CAST( COALESCE(e."VALORCLAUSULAVENTA", 0) AS NUMERIC(15,2)) AS VALORCLAUSULAVENTA_MOD
     ,aca.aduana_nombre AS aduana_nombre
     ,act.transporte_nombre AS transporte_nombre
     ,acp4.pais_nombre AS paisciatransp_nombre
@@ -303,8 +201,9 @@ CREATE VIEW canola.vw_imports_canola_trigo AS
 WITH CTE AS (
     (SELECT 'trigo' AS TIPO, * FROM canola.imports_raw
     WHERE 
-    /* Trigo - codigo arancel */
-    ARANC_NAC LIKE '0910%' OR ARANC_NAC LIKE '1001%' OR ARANC_NAC LIKE '1002%' OR ARANC_NAC LIKE '1003%' OR ARANC_NAC LIKE '1004%' OR ARANC_NAC LIKE '1005%' OR ARANC_NAC LIKE '1006%' OR ARANC_NAC LIKE '1007%')
+    /* Trigo - codigo arancel. Codes of chapters 01 to 09 have 7 digits when the leading zero is missing (0910: '910____') */
+    ARANC_NAC LIKE '0910____' OR ARANC_NAC LIKE '910____' OR ARANC_NAC LIKE '1001%' OR ARANC_NAC LIKE '1002%' OR ARANC_NAC LIKE '1003%' OR
+    ARANC_NAC LIKE '1004%' OR ARANC_NAC LIKE '1005%' OR ARANC_NAC LIKE '1006%' OR ARANC_NAC LIKE '1007%')
     UNION
     (SELECT 'trigo' AS TIPO, * FROM canola.imports_raw
     WHERE 
@@ -314,7 +213,7 @@ WITH CTE AS (
     (SELECT 'canola' AS TIPO, * FROM canola.imports_raw
     WHERE 
     /* Canola - codigo arancel */
-    ARANC_NAC LIKE '23063000%' OR ARANC_NAC LIKE '23064100%' OR ARANC_NAC LIKE '23064900%' OR ARANC_NAC LIKE '15141100%' OR ARANC_NAC LIKE '23064000%' OR ARANC_NAC LIKE '15141100' OR ARANC_NAC LIKE '1205%') 
+    ARANC_NAC LIKE '23063000%' OR ARANC_NAC LIKE '23064100%' OR ARANC_NAC LIKE '23064900%' OR ARANC_NAC LIKE '15141100%' OR ARANC_NAC LIKE '23064000%' OR ARANC_NAC LIKE '15141100' OR ARANC_NAC LIKE '1205%')
     UNION
     (SELECT 'canola' AS TIPO, * FROM canola.imports_raw
     WHERE 
@@ -334,9 +233,12 @@ WHERE DNOMBRE NOT LIKE '%SOLUCION%' AND DNOMBRE NOT LIKE '%BENZOATO%' AND DNOMBR
 	  DNOMBRE NOT LIKE '%HIDROFOBICA%' AND DESOBS1 NOT LIKE '%BOTELLAS%' AND DESOBS1 NOT LIKE '%FIDEOS%' AND DESOBS1 NOT LIKE '%PALOMITA%' AND DESOBS1 NOT LIKE '%CONDIMENTO%' AND
 	  DESOBS1 NOT LIKE '%CABLE%' AND DESOBS1 NOT LIKE '%PASTA%' AND DMARCA NOT LIKE '%SAZONADOR%' AND
 cant_merc_mod > 2 AND 
-ARANC_NAC NOT IN (
+/* Codes of chapters 01 to 09 with and without the leading zero */
+COALESCE(ARANC_NAC, '') NOT IN (
 '7129099',
+'07129099',
 '9109100',
+'09109100',
 '10063010',
 '10063020',
 '10063090',
@@ -484,9 +386,11 @@ GO
 
 CREATE VIEW canola.vw_exports_canola_trigo AS 
 WITH CTE AS ( 
+        /* Codes of chapters 01 to 09 have 7 digits when the leading zero is missing (0910: '910____') */
         (SELECT 'trigo' AS TIPO, * FROM canola.exports_raw 
-        WHERE CODIGOARANCEL LIKE '0910%' OR CODIGOARANCEL LIKE '1001%' OR CODIGOARANCEL LIKE '1002%' OR CODIGOARANCEL LIKE '1003%' OR CODIGOARANCEL LIKE '1004%' OR 
-			  CODIGOARANCEL LIKE '1005%' OR CODIGOARANCEL LIKE '1006%' OR CODIGOARANCEL LIKE '1007%')
+        WHERE CODIGOARANCEL LIKE '0910____' OR CODIGOARANCEL LIKE '910____' OR CODIGOARANCEL LIKE '1001%' OR CODIGOARANCEL LIKE '1002%' OR
+              CODIGOARANCEL LIKE '1003%' OR CODIGOARANCEL LIKE '1004%' OR CODIGOARANCEL LIKE '1005%' OR CODIGOARANCEL LIKE '1006%' OR
+              CODIGOARANCEL LIKE '1007%')
         UNION
         (SELECT 'trigo' AS TIPO, * FROM canola.exports_raw 
         WHERE NOMBRE LIKE '%TRIGO%' OR NOMBRE LIKE '%CENTENO%' OR NOMBRE LIKE '%MAIZ%' OR NOMBRE LIKE '%CEBADA%')
@@ -511,7 +415,7 @@ WHERE NOMBRE NOT LIKE '%SOLUCION%' AND NOMBRE NOT LIKE '%VESTIDO%' AND NOMBRE NO
         ATRIBUTO1 NOT LIKE '%BOTELLAS%' AND ATRIBUTO1 NOT LIKE '%FIDEOS%' AND ATRIBUTO1 NOT LIKE '%PALOMITA%' AND ATRIBUTO1 NOT LIKE '%CONDIMENTO%' AND ATRIBUTO1 NOT LIKE '%CABLE%' AND
         ATRIBUTO1 NOT LIKE '%PASTA%' AND
         CANTIDADMERCANCIA_MOD > 2 AND 
-        CODIGOARANCEL NOT IN (
+        COALESCE(CODIGOARANCEL, '') NOT IN (
     '10063010','10063020','10063090','19041000','19059090','22030000','29163190','29214100','30043212','30043910','31010000','31051090',
     '32159000','33051010','33051020','33059020','33059090','33074990','38099190','39231010','39231090','39232990','39239090','39241000',
 	'39241000','39269090','40169390','42022210','42022220','42023900','42029220','42050000','44079110','44219990','46021900','47062000',
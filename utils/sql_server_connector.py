@@ -19,7 +19,11 @@ import logging
 from datetime import datetime
 import pytz
 import ast
+import time
+import threading
+from contextlib import contextmanager
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 def sqlalchemy_db_uri(datacreds, dbms='sql_server'):
     """Create SQL Alchemy connection string"""
@@ -169,6 +173,94 @@ def df_col_tz_conversion(logger, log_prefix, df, meta=None, to_tz=None, str_form
     return df
 
 
+def get_sql_type(dtype):
+    """ SQL Server type of a pandas dtype (columns without a type in the schema registry) """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bit'
+    if pd.api.types.is_integer_dtype(dtype):
+        return {1: 'smallint', 2: 'smallint', 4: 'int'}.get(dtype.itemsize, 'bigint')
+    if pd.api.types.is_float_dtype(dtype):
+        return 'real' if dtype.itemsize == 4 else 'float'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime2'
+    return 'varchar(max)'
+
+
+def get_statement_label(stmt, length=100):
+    """ First line of a SQL statement (without comments) to identify it in reports. The table of a SELECT ... INTO
+    is added (e.g. statements that start with a CTE) """
+    label = str(stmt).strip()
+    for line in str(stmt).splitlines():
+        line = line.strip()
+        if line and not line.startswith('--') and not line.startswith('/*'):
+            label = line
+            break
+    into = re.search(r'\bINTO\s+([\w\.\[\]"]+)', str(stmt), flags=re.IGNORECASE)
+    if into is not None and into.group(1) not in label:
+        label = label + " ... INTO " + into.group(1)
+    return label[:length]
+
+
+# Columns of the report of execute_sql_batch and execute_sql_parallel
+SQL_REPORT_COLUMNS = ['statement', 'seconds', 'rows', 'status', 'error']
+
+
+def log_sql_report(logger, log_prefix, report, top=config.Config.SQL_REPORT_TOP):
+    """ Log the totals and the top slowest statements of a SQL report """
+    if len(report) > 0:
+        logger.info(log_prefix + str(len(report)) + " statements executed in " +
+                    str(round(report['seconds'].sum(), 2)) + " seconds (" +
+                    str((report['status'] == 'error').sum()) + " errors). Slowest:")
+        for index, row in report.nlargest(top, 'seconds').iterrows():
+            logger.info(log_prefix + "{:8.2f} s  {:>8} rows  {}".format(row['seconds'], row['rows'],
+                                                                     row['statement']))
+
+
+def get_statement_objects(stmt, schema_name, prefix=''):
+    """ Objects of schema_name (tables, views, functions) referenced by a statement, lower case without brackets.
+    prefix: regex that must come right before the object (e.g. the keywords of the objects written) """
+    pattern = prefix + r'\[?' + re.escape(schema_name) + r'\]?\.(\[[^\]]+\]|"[^"]+"|\w+)'
+    return set(o.strip('[]"').lower() for o in re.findall(pattern, stmt, flags=re.IGNORECASE))
+
+
+# Keywords before the objects written by a statement (CREATE/DROP/ALTER/TRUNCATE TABLE, DROP ... IF EXISTS,
+# CREATE INDEX ... ON, SELECT/INSERT INTO, UPDATE, DELETE FROM)
+WRITE_PREFIX = r'(?:\b(?:TABLE|VIEW|FUNCTION|EXISTS|ON|INTO|UPDATE|DELETE\s+FROM)\s+)'
+
+
+def get_statement_dependencies(stmts, schema_name):
+    """ Dependency graph of parsed statements: for every statement, the indexes of the statements that must run
+    before it. A statement that writes an object (see WRITE_PREFIX) runs after the previous statements that read or
+    write it (so DROP runs before CREATE and the indexes of a table run one after the other). A statement that reads
+    an object runs after the previous statement that writes it. Statements that only read the same objects are
+    independent. Statements without objects of schema_name (e.g. partition functions) are barriers: they run after
+    everything before them and before everything after them """
+    dependencies = []
+    last_write = {}
+    reads = {}
+    barrier = None
+    since_barrier = []
+    for i, stmt in enumerate(stmts):
+        objects = get_statement_objects(stmt, schema_name)
+        writes = get_statement_objects(stmt, schema_name, WRITE_PREFIX) & objects
+        # If no object written is found, all the objects are assumed to be written
+        writes = writes if len(writes) > 0 else objects
+        d = set() if barrier is None else {barrier}
+        if len(objects) == 0:
+            d.update(since_barrier)
+            barrier, since_barrier, last_write, reads = i, [], {}, {}
+        else:
+            d.update(last_write[o] for o in objects if o in last_write)
+            for o in writes:
+                d.update(reads.pop(o, []))
+                last_write[o] = i
+            for o in objects - writes:
+                reads.setdefault(o, []).append(i)
+            since_barrier.append(i)
+        dependencies.append(d)
+    return dependencies
+
+
 def _create_database_engine(conn_str):
     """Create a sqlalchemy database engine """
     if config.Config.SQLALCHEMY_ECHO is None:
@@ -177,9 +269,15 @@ def _create_database_engine(conn_str):
         engine = db.create_engine(url=conn_str,
                                   echo=config.Config.SQLALCHEMY_ECHO)
     else:
+        # Pool shared by the loaders and readers (pre_ping: connections are checked before they are handed out)
         engine = db.create_engine(url=conn_str,
                                   fast_executemany=config.Config.FAST_EXECUTEMANY,
-                                  echo=config.Config.SQLALCHEMY_ECHO)
+                                  echo=config.Config.SQLALCHEMY_ECHO,
+                                  pool_size=config.Config.SQLALCHEMY_POOL_SIZE,
+                                  max_overflow=config.Config.SQLALCHEMY_MAX_OVERFLOW,
+                                  pool_timeout=config.Config.SQLALCHEMY_POOL_TIMEOUT,
+                                  pool_recycle=config.Config.SQLALCHEMY_POOL_RECYCLE,
+                                  pool_pre_ping=config.Config.SQLALCHEMY_POOL_PRE_PING)
     return engine
 
 class SqlServerConnector:
@@ -199,10 +297,80 @@ class SqlServerConnector:
             self.logger.info(self.log_prefix + 'Reusing database engine...')
             self.engine = engine
         self.storage = storage
+        # Pool metrics (see get_pool_metrics)
+        self.pool_metrics = {'connects': 0, 'checkouts': 0, 'checkins': 0, 'wait_seconds': 0.0,
+                             'max_wait_seconds': 0.0, 'max_checked_out': 0, 'max_overflow': 0}
+        self._pool_metrics_lock = threading.Lock()
+        db.event.listen(self.engine, 'connect', self._on_pool_connect)
+        db.event.listen(self.engine, 'checkout', self._on_pool_checkout)
+        db.event.listen(self.engine, 'checkin', self._on_pool_checkin)
         if not is_sql_alchemy_logging:
             self.logger.info(self.log_prefix + 'Turning off SQLAlchemy logging...')
             logging.getLogger('sqlalchemy').setLevel(logging.ERROR)
 
+    def _on_pool_connect(self, dbapi_connection, connection_record):
+        with self._pool_metrics_lock:
+            self.pool_metrics['connects'] += 1
+
+    def _on_pool_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._pool_metrics_lock:
+            self.pool_metrics['checkouts'] += 1
+            pool = self.engine.pool
+            if hasattr(pool, 'checkedout'):
+                self.pool_metrics['max_checked_out'] = max(self.pool_metrics['max_checked_out'], pool.checkedout())
+                self.pool_metrics['max_overflow'] = max(self.pool_metrics['max_overflow'], pool.overflow())
+
+    def _on_pool_checkin(self, dbapi_connection, connection_record):
+        with self._pool_metrics_lock:
+            self.pool_metrics['checkins'] += 1
+
+    @contextmanager
+    def get_connection(self, is_raw=False, is_transaction=False):
+        """ Managed connection from the pool (returned to the pool on exit).
+        - is_raw: DBAPI connection (pyodbc), e.g. for cursors and executemany. Commit or rollback is up to the caller.
+        - is_transaction: SQLAlchemy connection inside a transaction (committed on exit, rolled back on error).
+        - Otherwise a SQLAlchemy connection.
+        The time waiting for a connection is added to the pool metrics """
+        start = time.perf_counter()
+        if is_raw:
+            connection = self.engine.raw_connection()
+        elif is_transaction:
+            context = self.engine.begin()
+            connection = context.__enter__()
+        else:
+            connection = self.engine.connect()
+        wait_seconds = time.perf_counter() - start
+        with self._pool_metrics_lock:
+            self.pool_metrics['wait_seconds'] += wait_seconds
+            self.pool_metrics['max_wait_seconds'] = max(self.pool_metrics['max_wait_seconds'], wait_seconds)
+        if is_transaction:
+            try:
+                yield connection
+            except BaseException as e:
+                if not context.__exit__(type(e), e, e.__traceback__):
+                    raise
+            else:
+                context.__exit__(None, None, None)
+        else:
+            try:
+                yield connection
+            finally:
+                connection.close()
+
+    def get_pool_metrics(self):
+        """ Pool metrics: connections opened, checkouts, checkins, time waiting for a connection, maximum connections
+        checked out at the same time and maximum overflow, plus the current status of the pool """
+        with self._pool_metrics_lock:
+            metrics = dict(self.pool_metrics)
+        metrics['status'] = self.engine.pool.status()
+        return metrics
+
+    def log_pool_metrics(self, extra_prefix=''):
+        metrics = self.get_pool_metrics()
+        self.logger.info(extra_prefix + self.log_prefix + "Pool metrics: " +
+                         ", ".join(k + "=" + (str(round(v, 3)) if isinstance(v, float) else str(v))
+                                   for k, v in metrics.items()))
+
     def get_schema_metadata(self, table_name="camera_event_detection"):
         """ Get the DB schema of a table (e.g. columns and data types) """
 
@@ -230,7 +398,7 @@ class SqlServerConnector:
         """ Insert Camera Event to DB """
         table_name = 'camera_event_detection'
         log_prefix = self.log_prefix + extra_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Inserting data...")
                 camera_event_detection = self.get_schema_metadata(table_name)
@@ -261,7 +429,7 @@ class SqlServerConnector:
         """ Insert Camera Image to DB """
         table_name = 'camera_event_images'
         log_prefix = self.log_prefix + extra_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Inserting data...")
                 image_name = self.generate_image_name(device_source_id=entity.device_source_id,
@@ -302,7 +470,7 @@ class SqlServerConnector:
         """ Insert Camera Image to DB """
         table_name = 'image_predictions'
         log_prefix = self.log_prefix + extra_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Inserting data...")
                 image_predictions = self.get_schema_metadata(table_name)
@@ -341,7 +509,7 @@ class SqlServerConnector:
                 is_continue = True
 
         if is_continue:
-            with self.engine.connect() as con:
+            with self.get_connection() as con:
                 try:
                     self.logger.info(log_prefix + "Inserting data...")
                     # Insert values for single camera event.
@@ -390,7 +558,7 @@ class SqlServerConnector:
         """ Insert records into entrance_registrations table """
         table_name = 'entrance_registrations'
         log_prefix = extra_prefix + self.log_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Inserting data...")
                 entrance_registrations = self.get_schema_metadata(table_name)
@@ -444,7 +612,7 @@ class SqlServerConnector:
         """ Insert records into exit_registrations table """
         table_name = 'exit_registrations'
         log_prefix = extra_prefix + self.log_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Inserting data...")
                 exit_registrations = self.get_schema_metadata(table_name)
@@ -508,7 +676,7 @@ class SqlServerConnector:
         """ Insert Camera Image to DB """
         table_name = 'deleted_records'
         log_prefix = self.log_prefix + "Table: " + table_name + "  - "
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             try:
                 self.logger.info(log_prefix + "Recording details of row to delete...")
                 deleted_records = self.get_schema_metadata(table_name)
@@ -568,7 +736,7 @@ class SqlServerConnector:
 
     def delete_camera_events(self, device_source_id, event_identifier="all"):
         """ delete camera detection records """
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             if event_identifier == "all":
                 stmt = f'''
                             DELETE FROM camera_event_detection 
@@ -631,7 +799,7 @@ class SqlServerConnector:
         device_type_lst = []
         device_subtype_lst = []
         device_brand_lst = []
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             stmt = "SELECT device_source_id, device_serial_number, device_mac_address, device_type, device_subtype, " \
                     "device_brand FROM devices"
             records = con.execute(text(stmt))
@@ -653,7 +821,7 @@ class SqlServerConnector:
                       FROM devices
                       WHERE device_source_id = '{str(device_source_id)}';
                         '''
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             gate_id = pd.read_sql(sql=text(query), con=con)
         if len(gate_id) > 0:
             gate_id = gate_id['gate_id'].iloc[0]
@@ -688,7 +856,7 @@ class SqlServerConnector:
             query = query + f' ORDER BY {order_by_col}'
         query = query + ';'
         try:
-            with self.engine.connect() as con:
+            with self.get_connection() as con:
                 output = pd.read_sql(sql=text(query), con=con)[curly_column].tolist()
             return output
         except Exception as e:
@@ -729,7 +897,7 @@ class SqlServerConnector:
             query = query + ' ' + add_order_by
         query = query + ';'
 
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             df = pd.read_sql(sql=text(query), con=con)
 
         # Transform all date columns to backend TZ.
@@ -748,7 +916,7 @@ class SqlServerConnector:
 
     def read_query(self, query):
         """Read table named table_name"""
-        with self.engine.connect() as con:
+        with self.get_connection() as con:
             df = pd.read_sql(sql=text(query), con=con)
         return df
 
@@ -818,12 +986,135 @@ class SqlServerConnector:
         query = query + ';'
         self._execute_command(query)
 
+    def get_row_count(self, table, schema='dbo'):
+        """ Number of rows of a table from the partition statistics (no table scan) """
+        query = "SELECT COALESCE(SUM(row_count), 0) AS num_records FROM sys.dm_db_partition_stats " \
+                "WHERE object_id = OBJECT_ID('{0}.{1}') AND index_id IN (0, 1);".format(schema, table)
+        return int(self.read_query(query)['num_records'].iloc[0])
+
+    def set_secondary_indexes(self, table, schema='dbo', is_enabled=True):
+        """ Disable the nonclustered indexes of a table or enable them again (REBUILD) """
+        query = "SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID('{0}.{1}') AND type = 2;".format(schema, table)
+        action = 'REBUILD' if is_enabled else 'DISABLE'
+        for index_name in self.read_query(query)['name']:
+            self._execute_command(f'ALTER INDEX {index_name} ON {schema}.{table} {action};')
+
+    def is_columnstore(self, table, schema='dbo'):
+        """ True if table has a clustered columnstore index """
+        query = "SELECT COUNT(*) AS num_indexes FROM sys.indexes " \
+                "WHERE object_id = OBJECT_ID('{0}.{1}') AND type = 5;".format(schema, table)
+        return int(self.read_query(query)['num_indexes'].iloc[0]) > 0
+
+    def reorganize_columnstore(self, table, schema='dbo'):
+        """ Compress the open rowgroups of the deltastore and merge small rowgroups """
+        query = "SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID('{0}.{1}') AND type = 5;".format(schema, table)
+        for index_name in self.read_query(query)['name']:
+            self._execute_command(f'ALTER INDEX {index_name} ON {schema}.{table} '
+                                  f'REORGANIZE WITH (COMPRESS_ALL_ROW_GROUPS = ON);')
+
+    def create_table(self, df, table_name, schema='dbo', column_types=None):
+        """ Typed CREATE TABLE with the columns of df (if the table does not exist).
+        column_types: {column: SQL Server type} (other columns get the type of their dtype, see get_sql_type) """
+        column_types = {} if column_types is None else column_types
+        columns = ",\n    ".join('"' + c + '" ' + column_types.get(c, get_sql_type(df[c].dtype)) for c in df.columns)
+        self.logger.info(self.log_prefix + f'Creating table {schema}.{table_name}...')
+        self._execute_command(f"IF OBJECT_ID('{schema}.{table_name}', 'U') IS NULL\n"
+                              f"CREATE TABLE {schema}.{table_name} (\n    {columns}\n);")
+
+    def create_staging_table(self, table, stage, schema='dbo', partition_scheme=None, partition_column=None,
+                             is_columnstore=False):
+        """ Empty heap with the columns of table. A partition is bulk loaded into it before attaching it to table.
+        With partition_scheme the staging table gets the clustered index of a partitioned table (rowstore or
+        columnstore, see get_storage_commands) so that it can be switched in """
+        self._execute_command(f'DROP TABLE IF EXISTS {schema}.{stage};')
+        self._execute_command(f'SELECT TOP 0 * INTO {schema}.{stage} FROM {schema}.{table};')
+        if partition_scheme is not None and is_columnstore:
+            self._execute_command(f'CREATE CLUSTERED COLUMNSTORE INDEX cci_{stage} ON {schema}.{stage} '
+                                  f'ON {partition_scheme}({partition_column});')
+        elif partition_scheme is not None:
+            self._execute_command(f'CREATE CLUSTERED INDEX cix_{stage}_{partition_column} ON {schema}.{stage} '
+                                  f'({partition_column}) ON {partition_scheme}({partition_column});')
+
+    def copy_indexes(self, table, stage, schema='dbo'):
+        """ Create on stage the nonclustered indexes of table (same name and key columns) """
+        query = "SELECT i.name AS index_name, c.name AS column_name FROM sys.indexes i " \
+                "JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id " \
+                "JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id " \
+                "WHERE i.object_id = OBJECT_ID('{0}.{1}') AND i.type = 2 AND ic.is_included_column = 0 " \
+                "AND ic.key_ordinal > 0 ORDER BY i.name, ic.key_ordinal;".format(schema, table)
+        indexes = self.read_query(query)
+        for index_name, df in indexes.groupby('index_name', sort=False):
+            columns = ", ".join('"' + c + '"' for c in df['column_name'])
+            self._execute_command(f'CREATE INDEX {index_name} ON {schema}.{stage} ({columns});')
+
+    def attach_staging_table(self, table, stage, schema='dbo', partition_function=None, partition_key=None):
+        """ Move the rows of a staging table into table and drop the staging table.
+        With partition_function the partition of partition_key is switched in (metadata only, the partition of table
+        must be empty). Otherwise INSERT...SELECT """
+        if partition_function is not None:
+            self.copy_indexes(table=table, stage=stage, schema=schema)
+            partition = f'$PARTITION.{partition_function}({partition_key})'
+            self._execute_command(f'ALTER TABLE {schema}.{stage} SWITCH PARTITION {partition} '
+                                  f'TO {schema}.{table} PARTITION {partition};')
+        else:
+            self._execute_command(f'INSERT INTO {schema}.{table} WITH (TABLOCK) SELECT * FROM {schema}.{stage};')
+        self._execute_command(f'DROP TABLE {schema}.{stage};')
+
+    def merge_staging_table(self, table, stage, schema='dbo', key_column='reference_id', period_column=None,
+                            period_key=None):
+        """ Upsert the rows of a staging table into table on key_column and drop the staging table, in one transaction.
+        Only new rows are inserted and only rows with a different value are updated, so a rerun costs the changed rows.
+        With period_column the rows of period_key that are not in the staging table are deleted.
+        Returns the number of rows inserted, updated and deleted """
+        query = "SELECT name FROM sys.columns WHERE object_id = OBJECT_ID('{0}.{1}') " \
+                "ORDER BY column_id;".format(schema, stage)
+        columns = self.read_query(query)['name'].tolist()
+        insert_columns = ", ".join('"' + c + '"' for c in columns)
+        insert_values = ", ".join('s."' + c + '"' for c in columns)
+        update_columns = ", ".join('"' + c + '" = s."' + c + '"' for c in columns if c != key_column)
+
+        if period_column is not None:
+            # Target restricted to the period (updatable CTE)
+            target = "target"
+            stmt = f'WITH target AS (SELECT * FROM {schema}.{table} WHERE "{period_column}" = {period_key})\n'
+            delete = 'WHEN NOT MATCHED BY SOURCE THEN DELETE\n'
+        else:
+            target = f'{schema}.{table}'
+            stmt = ''
+            delete = ''
+        stmt = stmt + f'''MERGE {target} AS t
+                        USING {schema}.{stage} AS s ON t."{key_column}" = s."{key_column}"
+                        WHEN MATCHED AND EXISTS (SELECT s.* EXCEPT SELECT t.*) THEN UPDATE SET {update_columns}
+                        WHEN NOT MATCHED BY TARGET THEN INSERT ({insert_columns}) VALUES ({insert_values})
+                        {delete}OUTPUT $action;'''
+
+        with self.get_connection(is_transaction=True) as conn:
+            actions = [r[0] for r in conn.execute(text(stmt))]
+            conn.execute(text(f'DROP TABLE {schema}.{stage};'))
+        return {a: actions.count(a) for a in ['INSERT', 'UPDATE', 'DELETE']}
+
+    def get_partition_boundaries(self, partition_function):
+        """ Boundary values of an int partition function, sorted """
+        query = "SELECT CAST(v.value AS int) AS boundary FROM sys.partition_range_values v " \
+                "JOIN sys.partition_functions f ON f.function_id = v.function_id " \
+                "WHERE f.name = '{0}' ORDER BY v.boundary_id;".format(partition_function)
+        return self.read_query(query)['boundary'].tolist()
+
+    def truncate_partitions(self, table, partition_function, partition_keys, schema='dbo'):
+        """ Remove the rows of the partitions of partition_keys (minimally logged, instead of DELETE). Every partition
+        must hold only its partition_key (see data_process.get_partitioned_keys) """
+        # TRUNCATE needs partition numbers
+        query = " UNION ".join(f'SELECT $PARTITION.{partition_function}({k}) AS p' for k in partition_keys) + ';'
+        partition_numbers = self.read_query(query)['p'].tolist()
+        partitions = ", ".join(str(p) for p in sorted(partition_numbers))
+        self._execute_command(f'TRUNCATE TABLE {schema}.{table} WITH (PARTITIONS ({partitions}));')
+
     def _execute_command(self, stmt):
         """
         The Connection object provides a Connection.begin() method which returns a Transaction object. Like the
         Connection itself, this object is usually used within a Python with: block so that its scope is managed:
         """
-        with self.engine.begin() as conn:
+        with self.get_connection(is_transaction=True) as conn:
             conn.execute(text(stmt))
 
     @staticmethod
@@ -928,26 +1219,117 @@ class SqlServerConnector:
                 stmts.append(line.strip())
         return stmts
 
-    @staticmethod
-    def execute_sql_batch(logger, log_prefix, raw_connection, query_parsed, debug=False):
-        # Commit Transactions by batch
+    def execute_sql_batch(self, logger, log_prefix, raw_connection, query_parsed, debug=False, transaction_size=1,
+                          is_stop_on_error=False, top=config.Config.SQL_REPORT_TOP):
+        """ Execute parsed statements, committing every transaction_size statements (a failed statement rolls back
+        its transaction). is_stop_on_error: do not run the statements after the first error.
+        raw_connection: None to check out a connection from the pool for the batch.
+        Returns a report (DF) with the wall time, affected rows (-1 if not available) and status of every statement.
+        The top slowest statements are logged """
+        if raw_connection is None:
+            with self.get_connection(is_raw=True) as raw_connection:
+                return self.execute_sql_batch(logger, log_prefix, raw_connection, query_parsed, debug=debug,
+                                              transaction_size=transaction_size, is_stop_on_error=is_stop_on_error,
+                                              top=top)
+        report = []
+        transaction = []
         with raw_connection.cursor() as cursor:
             for stmt in query_parsed:
-                if stmt != "":
-                    try:
-                        cursor.execute(stmt)
+                if stmt == "":
+                    continue
+                start = time.perf_counter()
+                try:
+                    cursor.execute(stmt)
+                    report.append({'statement': get_statement_label(stmt), 'seconds': time.perf_counter() - start,
+                                   'rows': cursor.rowcount, 'status': 'ok', 'error': None})
+                    transaction.append(report[-1])
+                    if len(transaction) >= transaction_size:
                         raw_connection.commit()
-                    except Exception as e:
-                        if debug:
-                            logger.error(log_prefix + "SQL Statement: \n " + str(stmt))
-                        logger.error(log_prefix + ". Error: %s" % e)
+                        transaction = []
+                except Exception as e:
+                    raw_connection.rollback()
+                    for r in transaction:
+                        r['status'] = 'rolled back'
+                    transaction = []
+                    report.append({'statement': get_statement_label(stmt), 'seconds': time.perf_counter() - start,
+                                   'rows': -1, 'status': 'error', 'error': str(e)})
+                    if debug:
+                        logger.error(log_prefix + "SQL Statement: \n " + str(stmt))
+                    logger.error(log_prefix + ". Error: %s" % e)
+                    if is_stop_on_error:
+                        break
+            raw_connection.commit()
+
+        report = pd.DataFrame(report, columns=SQL_REPORT_COLUMNS)
+        log_sql_report(logger, log_prefix, report, top)
+        return report
+
+    @staticmethod
+    def execute_sql_parallel(logger, log_prefix, conn, query_parsed, schema_name, workers=config.Config.DDL_WORKERS,
+                             debug=False, is_stop_on_error=False, top=config.Config.SQL_REPORT_TOP):
+        """ Parallel version of execute_sql_batch. Statements run as soon as the statements they depend on are done
+        (see get_statement_dependencies), up to workers at the same time, each on its own pooled connection and
+        transaction. The wall time is the one of the critical path. Returns the same report as execute_sql_batch """
+        query_parsed = [stmt for stmt in query_parsed if stmt != ""]
+        dependencies = get_statement_dependencies(query_parsed, schema_name)
+        dependents = {i: [] for i in range(len(query_parsed))}
+        for i, d in enumerate(dependencies):
+            for j in d:
+                dependents[j].append(i)
+
+        def run(stmt):
+            with conn.get_connection(is_raw=True) as raw_connection:
+                start = time.perf_counter()
+                try:
+                    with raw_connection.cursor() as cursor:
+                        cursor.execute(stmt)
+                        rows = cursor.rowcount
+                    raw_connection.commit()
+                    return {'statement': get_statement_label(stmt), 'seconds': time.perf_counter() - start,
+                            'rows': rows, 'status': 'ok', 'error': None}
+                except Exception as e:
+                    raw_connection.rollback()
+                    if debug:
+                        logger.error(log_prefix + "SQL Statement: \n " + str(stmt))
+                    logger.error(log_prefix + ". Error: %s" % e)
+                    return {'statement': get_statement_label(stmt), 'seconds': time.perf_counter() - start,
+                            'rows': -1, 'status': 'error', 'error': str(e)}
+
+        start = time.perf_counter()
+        report = {}
+        remaining = [set(d) for d in dependencies]
+        ready = [i for i, d in enumerate(remaining) if len(d) == 0]
+        running = {}
+        is_stopped = False
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(running) > 0 or (len(ready) > 0 and not is_stopped):
+                # Statements in script order when several are ready
+                ready.sort()
+                while len(ready) > 0 and not is_stopped:
+                    i = ready.pop(0)
+                    running[executor.submit(run, query_parsed[i])] = i
+                done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+                for f in done:
+                    i = running.pop(f)
+                    report[i] = f.result()
+                    is_stopped = is_stopped or (is_stop_on_error and report[i]['status'] == 'error')
+                    for j in dependents[i]:
+                        remaining[j].discard(i)
+                        if len(remaining[j]) == 0:
+                            ready.append(j)
+
+        report = pd.DataFrame([report[i] for i in sorted(report)], columns=SQL_REPORT_COLUMNS)
+        logger.info(log_prefix + "Parallel SQL on " + str(workers) + " connections: " +
+                    str(round(time.perf_counter() - start, 2)) + " seconds wall time.")
+        log_sql_report(logger, log_prefix, report, top)
+        return report
 
     @staticmethod
     def create_azure_storage_credential(logger, log_prefix, conn, database_scoped_credential_name, master_key,sas_token):
 
         logger.info(log_prefix + "Dropping all external data sources...")
 
-        with conn.engine.connect() as con:
+        with conn.get_connection() as con:
             query = 'SELECT name FROM sys.external_data_sources;'
             external_datasource_list = list(pd.read_sql(sql=text(query), con=con)['name'])
 
@@ -967,7 +1349,7 @@ class SqlServerConnector:
                          f'''DROP MASTER KEY;''']
             conn.execute_sql_batch(logger=logger,
                                    log_prefix=log_prefix,
-                                   raw_connection=conn.engine.raw_connection(),
+                                   raw_connection=None,
                                    query_parsed=stmt_list,
                                    debug=False)
         except Exception as e:
@@ -981,7 +1363,7 @@ class SqlServerConnector:
                              SECRET = '{sas_token}';''']
             conn.execute_sql_batch(logger=logger,
                                    log_prefix=log_prefix,
-                                   raw_connection=conn.engine.raw_connection(),
+                                   raw_connection=None,
                                    query_parsed=stmt_list,
                                    debug=False)
         except Exception as e:
@@ -1006,11 +1388,12 @@ class SqlServerConnector:
 
     @staticmethod
     def copy_from_file(logger, log_prefix, conn, schema_name, table_name, df=None, path_to_csv=None, is_local=True,
-                       external_data_source_name=None):
+                       external_data_source_name=None, is_tablock=False, batch_size=None):
         """
         Here we are going save the dataframe to disk as a csv file, load the csv file and use BULK operation to copy
         to a DB table.
         Always assume the .csv files are stored as "<schema_name>.<table_name>.csv"
+        is_tablock and batch_size: TABLOCK and BATCHSIZE options of BULK INSERT (local files).
         """
         file_name = schema_name + "." + table_name + ".csv"
         try:
@@ -1029,7 +1412,7 @@ class SqlServerConnector:
                         # Save the dataframe to disk
                         if not path.exists(csv_full_path):
                             logger.info(log_prefix + "CSV file DOES NOT exists. Writing dataframe to CSV: " + str(csv_full_path))
-                            df.to_csv(csv_full_path, index=False, sep=";", header=False)
+                            df.to_csv(csv_full_path, index=False, sep=";", header=False, lineterminator='\n')
                         else:
                             logger.info(log_prefix + "CSV file exists. Skipping df.to_csv(). Using file " + str(csv_full_path))
                     else:
@@ -1038,9 +1421,14 @@ class SqlServerConnector:
                             logger.error(log_prefix + "Dataframe not provided and .csv file does not exist.")
                             return False
 
+                    options = "FORMAT = 'CSV', FIELDTERMINATOR = ';', ROWTERMINATOR = '0x0a'"
+                    if is_tablock:
+                        options = options + ", TABLOCK"
+                    if batch_size is not None:
+                        options = options + ", BATCHSIZE = " + str(batch_size)
                     stmt = f'''
                             BULK INSERT {schema_name}.{table_name} FROM '{csv_full_path}' 
-                            WITH (FORMAT = 'CSV', FIELDTERMINATOR = ';', ROWTERMINATOR = '0x0a');
+                            WITH ({options});
                             '''
                 else:
                     stmt = f'''
@@ -1049,7 +1437,7 @@ class SqlServerConnector:
                             '''
 
                 logger.info(log_prefix + "Executing BULK statement...")
-                with conn.engine.begin() as conn:
+                with conn.get_connection(is_transaction=True) as conn:
                     conn.execute(text(stmt))
                     output = True
                 logger.info(log_prefix + "BULK load complete.")
@@ -1073,6 +1461,77 @@ class SqlServerConnector:
 
         return output
 
+    @staticmethod
+    def get_table_column_types(conn, schema_name, table_name):
+        """ {column name: SQL data type} of a table """
+        query = "SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS " \
+                "WHERE TABLE_SCHEMA = '{0}' AND TABLE_NAME = '{1}';".format(schema_name, table_name)
+        column_types = conn.read_query(query)
+        return dict(zip(column_types['COLUMN_NAME'], column_types['DATA_TYPE'].str.lower()))
+
+    @staticmethod
+    def copy_from_dataframe(logger, log_prefix, conn, schema_name, table_name, df,
+                            batch_size=config.Config.BULK_BATCH_SIZE, is_tablock=False):
+        """
+        Stream a dataframe to a DB table over the client connection (no .csv file on the SQL Server host).
+        Rows are sent in batches of parameterized INSERT with pyodbc fast_executemany (parameters are bound as arrays).
+        Columns are matched by name. Values for text columns are sent as they would be written to the .csv file.
+        is_tablock: INSERT WITH (TABLOCK).
+        """
+        try:
+            column_types = SqlServerConnector.get_table_column_types(conn, schema_name, table_name)
+            columns = [str(c) for c in df.columns]
+            missing = [c for c in columns if c not in column_types]
+            if len(missing) > 0:
+                logger.error(log_prefix + "Columns not found in " + schema_name + "." + table_name + ": " + str(missing))
+                return False
+
+            stmt = "INSERT INTO {0}.{1}{2} ({3}) VALUES ({4});".format(schema_name, table_name,
+                                                                     " WITH (TABLOCK)" if is_tablock else "",
+                                                                     ", ".join("[" + c + "]" for c in columns),
+                                                                     ", ".join("?" * len(columns)))
+            with conn.get_connection(is_raw=True) as raw_connection:
+                cursor = raw_connection.cursor()
+                cursor.fast_executemany = True
+                logger.info(log_prefix + "Inserting " + str(len(df)) + " rows into " + schema_name + "." + table_name +
+                            " in batches of " + str(batch_size) + "...")
+                for start in range(0, len(df), batch_size):
+                    batch = df.iloc[start:start + batch_size]
+                    values = {}
+                    for c, name in zip(batch.columns, columns):
+                        col = batch[c]
+                        if column_types[name] in ('char', 'varchar', 'nchar', 'nvarchar', 'text', 'ntext') and \
+                                not pd.api.types.is_string_dtype(col.dtype):
+                            col = col.astype(str).mask(col.isna())
+                        values[name] = col.astype(object).where(col.notna(), None)
+                    cursor.executemany(stmt, list(zip(*values.values())))
+                raw_connection.commit()
+                cursor.close()
+            logger.info(log_prefix + "Insert complete.")
+            output = True
+        except Exception as e:
+            logger.error(log_prefix + ". Error: %s" % e)
+            output = False
+        return output
+
+    @staticmethod
+    def bulk_load(logger, log_prefix, conn, schema_name, table_name, df=None, path_to_csv=None,
+                  sink=config.Config.BULK_SINK, is_tablock=False, batch_size=None):
+        """
+        Bulk sink: load a dataframe (or the .csv file "<schema_name>.<table_name>.csv" when df is None) into a table.
+        sink: 'csv' (copy_from_file) or 'executemany' (copy_from_dataframe).
+        is_tablock: TABLOCK hint of BULK INSERT (csv) or INSERT (executemany).
+        batch_size: BATCHSIZE of BULK INSERT (csv) or rows per executemany call (Config.BULK_BATCH_SIZE if None).
+        """
+        if sink == 'executemany' and df is not None:
+            return SqlServerConnector.copy_from_dataframe(logger=logger, log_prefix=log_prefix, conn=conn,
+                                                          schema_name=schema_name, table_name=table_name, df=df,
+                                                          batch_size=batch_size or config.Config.BULK_BATCH_SIZE,
+                                                          is_tablock=is_tablock)
+        return SqlServerConnector.copy_from_file(logger=logger, log_prefix=log_prefix, conn=conn,
+                                                 schema_name=schema_name, table_name=table_name, df=df,
+                                                 path_to_csv=path_to_csv, is_tablock=is_tablock, batch_size=batch_size)
+
     def close(self, extra_prefix=''):
         log_prefix = extra_prefix + self.log_prefix
         """ Close all the active connections to the database. Does not
@@ -0,0 +1,86 @@
+import os
+import json
+from zipfile import ZipFile
+from utils.data_process import get_folders
+
+# Configure Tolveet Logger
+from config import TolveetLogger, Config, MAIN_DIR
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+
+def get_manifest_path():
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    return os.path.join(trade_folder, Config.TRADE_MANIFEST_FILE)
+
+
+def load_manifest():
+    """ Manifest of the trade zip members already loaded: {"zip_file/member": entry}.
+    An entry has the CRC32, size and timestamp of the member (from the zip central directory), its trade_type and the
+    periods it produced (None when unknown, see csv_load.bootstrap_manifest) """
+    manifest_path = get_manifest_path()
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning("Trade manifest can not be read. All members will be parsed. Error: " + str(e))
+        return {}
+
+
+def save_manifest(manifest):
+    manifest_path = get_manifest_path()
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def get_manifest_key(zip_file, member):
+    return zip_file + "/" + member
+
+
+def scan_members(members):
+    """ CRC32, size and timestamp of every (zip_file, member). Only the central directory is read (no decompression) """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    state = {}
+    for zip_file in sorted(set(z for z, m in members)):
+        with ZipFile(os.path.join(trade_folder, zip_file), 'r') as zipObj:
+            for zip_info in zipObj.infolist():
+                state[get_manifest_key(zip_file, zip_info.filename)] = {'crc': zip_info.CRC,
+                                                                         'size': zip_info.file_size,
+                                                                         'date_time': list(zip_info.date_time)}
+    return {get_manifest_key(z, m): state[get_manifest_key(z, m)] for z, m in members}
+
+
+def is_member_changed(manifest, key, member_state):
+    """ New member or CRC32/size different from the manifest """
+    entry = manifest.get(key)
+    return entry is None or entry['crc'] != member_state['crc'] or entry['size'] != member_state['size']
+
+
+def get_members_with_periods(manifest, members, periods, zip_files=()):
+    """ Members (zip_file, member) that produced any of periods according to the manifest. Members whose periods are
+    unknown (None) are taken when their zip file is one of zip_files """
+    output = []
+    for z, m in members:
+        entry = manifest.get(get_manifest_key(z, m))
+        if entry is None:
+            continue
+        if (entry['periods'] is None and z in zip_files) or len(set(entry['periods'] or []) & set(periods)) > 0:
+            output.append((z, m))
+    return output
+
+
+def get_removed_members(manifest, members):
+    """ Manifest keys whose member is no longer in the trade zip files """
+    keys = set(get_manifest_key(z, m) for z, m in members)
+    return [k for k in manifest if k not in keys]
+
+
+def get_loaded_manifest(manifest, previous_manifest, trade_types):
+    """ Manifest to save after a load: the entries of the trade_types that were loaded into the DB come from manifest,
+    the rest stay as they were in previous_manifest (their members are parsed again on the next run) """
+    output = {k: v for k, v in previous_manifest.items() if v.get('trade_type') not in trade_types}
+    output.update({k: v for k, v in manifest.items() if v.get('trade_type') in trade_types})
+    return output
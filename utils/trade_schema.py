@@ -0,0 +1,110 @@
+import pandas as pd
+import os
+import re
+from utils.data_process import get_folders
+
+# Configure Tolveet Logger
+from config import TolveetLogger, Config, MAIN_DIR
+TL = TolveetLogger()
+logger = TL.get_tolveet_logger()
+
+# Names in the column descriptions that differ from the headers (see get_headers)
+COLUMN_ALIASES = {'TPO_DOCTO': 'TIPO_DOCTO'}
+# Version of the rules that build the headers and schema (bump it when they change, e.g. get_column_dtype). It is part
+# of the key of the headers cache (csv_load.get_compiled_headers).
+SCHEMA_VERSION = 1
+
+
+def read_column_descriptions(headers_file):
+    """ Read the column description sheet (first sheet) of a DIN/DUS workbook.
+    Returns {column name: (tipo, largo, precision)} """
+    project_folder, columns_folder, dimensions_folder, currency_folder, trade_folder, temp_folder = get_folders(Config.TEMP_FOLDER)
+    raw = pd.read_excel(os.path.join(columns_folder, headers_file), sheet_name=0, header=None, dtype=str)
+
+    # The description table starts below the cell "tipo" (followed by "largo" and "precision")
+    tipo_cells = [(r, c) for r in range(len(raw)) for c in range(raw.shape[1])
+                  if str(raw.iat[r, c]).strip().lower() == 'tipo']
+    header_row, tipo_col = tipo_cells[0]
+
+    regex = re.compile("[^0-9a-zA-Z]+")
+    descriptions = {}
+    for r in range(header_row + 1, len(raw)):
+        name = raw.iat[r, 0]
+        tipo = raw.iat[r, tipo_col]
+        if pd.isna(name) or pd.isna(tipo):
+            continue
+        name = re.sub(regex, '_', name.strip())
+        name = COLUMN_ALIASES.get(name, name)
+        # Sub tables repeat some keys (e.g. NUMEROIDENT). Keep the first one.
+        if name not in descriptions:
+            descriptions[name] = (tipo.strip().upper(), raw.iat[r, tipo_col + 1], raw.iat[r, tipo_col + 2])
+    return descriptions
+
+
+def get_column_dtype(tipo, largo, precision):
+    """ Compact pandas dtype for a DIN/DUS column.
+    - DATE: DDMMYYYY as an integer.
+    - NUMBER: nullable integer sized by the number of digits or float when it has decimals. In the DUS largo 22 is
+      Oracle's default length and precision is the number of digits (12 or more are amounts with decimals).
+      Elsewhere precision is the number of decimals.
+    - VARCHAR2/CHAR: category for short codes, str otherwise. """
+    largo = float(largo) if not pd.isna(largo) else None
+    precision = float(precision) if not pd.isna(precision) and str(precision).isnumeric() else None
+
+    if tipo == 'DATE':
+        return 'Int32'
+    if tipo == 'NUMBER':
+        digits = largo
+        if largo == 22:
+            digits = precision if precision is not None else largo
+            if digits >= 12:
+                return 'float64'
+        elif precision is not None:
+            return 'float32' if largo <= 7 else 'float64'
+        if digits is None or digits > 9:
+            return 'Int64'
+        return 'Int16' if digits <= 4 else 'Int32'
+    if largo is not None and largo <= 3:
+        return 'category'
+    return 'str'
+
+
+# SQL Server types of the pandas dtypes of the schema registry (text columns are sized with largo)
+SQL_TYPES = {'Int16': 'smallint', 'Int32': 'int', 'Int64': 'bigint', 'float32': 'real', 'float64': 'float'}
+
+
+def get_column_sql_type(tipo, largo, precision):
+    """ SQL Server type of a DIN/DUS column (same rules as get_column_dtype) """
+    dtype = get_column_dtype(tipo, largo, precision)
+    if dtype in SQL_TYPES:
+        return SQL_TYPES[dtype]
+    if pd.isna(largo):
+        return 'varchar(max)'
+    return 'varchar(' + str(int(float(largo))) + ')'
+
+
+def get_trade_schema(headers_files, get_type=get_column_dtype):
+    """ Schema registry: {column name: dtype} for imports (DIN) and exports (DUS).
+    get_type: get_column_sql_type for {column name: SQL Server type} """
+    logger.info("Building trade schema from column descriptions...")
+    for f in headers_files:
+        if "din" in f:
+            import_headers_file = f
+        elif "dus" in f:
+            export_headers_file = f
+
+    schemas = []
+    for f in [import_headers_file, export_headers_file]:
+        descriptions = read_column_descriptions(f)
+        schemas.append({k: get_type(*v) for k, v in descriptions.items()})
+    return schemas[0], schemas[1]
+
+
+def get_parser_args(headers, schema, columns=None):
+    """ Typed parsing arguments of pd.read_csv (header=None) for a file with the given headers. Columns not described
+    in the schema are inferred by the parser. Decimals come with a comma (e.g. 1881,2).
+    columns: only read these columns (projection). Parsed columns are labeled with their position in headers """
+    usecols = [i for i, h in enumerate(headers) if columns is None or h in columns]
+    return {'dtype': {i: schema[headers[i]] for i in usecols if headers[i] in schema},
+            'usecols': usecols,
+            'decimal': ','}